@@ -1,165 +1,48 @@
-from typing import Dict, Optional, List
+import asyncio
+import copy
+import json
+import os
+import re
+import time
+from collections import deque
+from typing import AsyncIterator, Callable, Dict, Optional, List, Tuple
 import google.generativeai as genai
+from cache import ResponseCache, SemanticCache, embed_text, embed_text_async, make_cache_key
 from config import Config
+from gemini_client import generate, generate_async, get_model
 
 
-class AIMentor:
-    """AI Mentor providing guidance through critical thinking and solution templates"""
-    
-    def __init__(self, api_key: Optional[str] = None):
-        self.api_key = api_key or Config.GEMINI_API_KEY
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel(Config.TEXT_MODEL)
-        self.conversation_history = []
-    
-    def critical_thinking_mode(self, problem_description: str, 
-                              context: Optional[str] = None) -> Dict:
-        prompt = self._create_critical_thinking_prompt(problem_description, context)
-        
-        try:
-            response = self.model.generate_content(prompt)
-            result = response.text
-            
-            # Parse the response
-            parsed = self._parse_socratic_response(result)
-            
-            return {
-                'success': True,
-                'mode': 'Critical Thinking',
-                'problem': problem_description,
-                'guiding_questions': parsed.get('questions', []),
-                'reflection_prompts': parsed.get('reflections', []),
-                'challenge_points': parsed.get('challenges', []),
-                'next_steps': parsed.get('next_steps', []),
-                'full_response': result
-            }
-            
-        except Exception as e:
-            return {
-                'success': False,
-                'error': str(e),
-                'mode': 'Critical Thinking'
-            }
-    
-    def solution_mode(self, problem_description: str, 
-                     template_type: str = 'auto',
-                     category: Optional[str] = None) -> Dict:
-
-        # Determine best template if auto
-        if template_type == 'auto':
-            template_type = self._determine_template_type(problem_description, category)
-        
-        prompt = self._create_solution_template_prompt(
-            problem_description, 
-            template_type,
-            category
-        )
-        
-        try:
-            response = self.model.generate_content(prompt)
-            result = response.text
-            
-            # Parse template response
-            parsed = self._parse_template_response(result, template_type)
-            
-            return {
-                'success': True,
-                'mode': 'Solution',
-                'template_type': template_type,
-                'problem': problem_description,
-                'template': parsed.get('template', {}),
-                'implementation_guide': parsed.get('guide', ''),
-                'tips': parsed.get('tips', []),
-                'full_response': result
-            }
-            
-        except Exception as e:
-            return {
-                'success': False,
-                'error': str(e),
-                'mode': 'Solution'
-            }
-    
-    def interactive_mentoring(self, user_message: str, 
-                            mode: str = 'critical_thinking') -> Dict:
+_CHAT_SYSTEM_ROLES = {
+    'critical_thinking': """You are a Socratic mentor. Continue guiding through questions.
+Ask probing questions, encourage reflection, challenge assumptions.""",
+    'solution': """You are a solution-focused mentor. Provide practical frameworks,
+actionable advice, and concrete next steps."""
+}
 
-        # Add user message to history
-        self.conversation_history.append({
-            'role': 'user',
-            'content': user_message
-        })
-        
-        # Create context-aware prompt
-        prompt = self._create_interactive_prompt(user_message, mode)
-        
-        try:
-            response = self.model.generate_content(prompt)
-            mentor_response = response.text
-            
-            # Add mentor response to history
-            self.conversation_history.append({
-                'role': 'mentor',
-                'content': mentor_response
-            })
-            
-            return {
-                'success': True,
-                'mode': mode,
-                'user_message': user_message,
-                'mentor_response': mentor_response,
-                'conversation_length': len(self.conversation_history)
-            }
-            
-        except Exception as e:
-            return {
-                'success': False,
-                'error': str(e),
-                'mode': mode
-            }
-    
-    def reset_conversation(self):
-        """Clear conversation history"""
-        self.conversation_history = []
-    
-    def _create_critical_thinking_prompt(self, problem_description: str, 
-                                        context: Optional[str] = None) -> str:
-        """Create prompt for critical thinking mode"""
-        prompt = f"""You are a Socratic mentor who guides learners through critical thinking and reflection.
-Your role is to ask thought-provoking questions rather than give direct answers.
+# Number of most recent messages included in interactive prompts
+_PROMPT_HISTORY_WINDOW = 4
 
-Problem/Topic: {problem_description}
-"""
-        
-        if context:
-            prompt += f"\nContext: {context}\n"
-        
-        prompt += """
-Generate Socratic guidance in this format:
 
-GUIDING QUESTIONS:
-[3-5 open-ended questions that help the learner explore the problem deeply]
+# Keywords for auto-detecting the template type, in priority order
+_TEMPLATE_KEYWORDS = [
+    ('budget', ['budget', 'cost', 'funding', 'money', 'finance']),
+    ('stakeholder', ['stakeholder', 'community', 'people', 'involve']),
+    ('timeline', ['timeline', 'schedule', 'when', 'deadline']),
+    ('swot', ['strength', 'weakness', 'opportunity', 'threat', 'analyze'])
+]
 
-REFLECTION PROMPTS:
-[2-3 prompts that encourage self-reflection and analysis]
+_KEYWORD_TEMPLATES = {
+    keyword: (priority, template)
+    for priority, (template, keywords) in enumerate(_TEMPLATE_KEYWORDS)
+    for keyword in keywords
+}
 
-CHALLENGE POINTS:
-[2-3 challenging perspectives or assumptions to examine]
+# Substring matching like the original `in` checks, compiled into one pattern
+_TEMPLATE_KEYWORD_RE = re.compile('|'.join(map(re.escape, _KEYWORD_TEMPLATES)))
 
-NEXT STEPS:
-[Suggested thinking exercises or exploration activities]
 
-Remember: Ask questions, don't provide solutions. Guide discovery through inquiry.
-"""
-        
-        return prompt
-    
-    def _create_solution_template_prompt(self, problem_description: str, 
-                                        template_type: str,
-                                        category: Optional[str] = None) -> str:
-        """Create prompt for solution template generation"""
-        
-        template_instructions = {
-            'swot': """
+_TEMPLATE_INSTRUCTIONS = {
+    'swot': """
 Generate a SWOT Analysis template:
 
 STRENGTHS:
@@ -177,7 +60,7 @@ THREATS:
 STRATEGIC INSIGHTS:
 [Key takeaways and recommendations]
 """,
-            'budget': """
+    'budget': """
 Generate a Budget Outline template:
 
 REVENUE/FUNDING SOURCES:
@@ -195,7 +78,7 @@ BUDGET TIMELINE:
 COST-SAVING OPPORTUNITIES:
 [Ideas for efficiency]
 """,
-            'action_plan': """
+    'action_plan': """
 Generate an Action Plan template:
 
 OBJECTIVES:
@@ -216,7 +99,7 @@ SUCCESS METRICS:
 RISK MITIGATION:
 [Potential challenges and solutions]
 """,
-            'stakeholder': """
+    'stakeholder': """
 Generate a Stakeholder Analysis template:
 
 KEY STAKEHOLDERS:
@@ -234,7 +117,7 @@ ENGAGEMENT STRATEGY:
 COMMUNICATION PLAN:
 [How and when to communicate]
 """,
-            'timeline': """
+    'timeline': """
 Generate a Project Timeline template:
 
 PHASES:
@@ -252,184 +135,933 @@ CRITICAL PATH:
 BUFFER TIME:
 [Contingency periods]
 """
-        }
-        
-        instruction = template_instructions.get(template_type, template_instructions['action_plan'])
-        
-        prompt = f"""You are a solution-oriented mentor helping create practical frameworks.
+}
+
+
+# Prompts put all static instructions first and the problem last so that
+# repeated calls share a byte-identical prefix, which Gemini's implicit
+# prompt caching can reuse. Never interpolate request data into a prefix.
+_CT_STATIC_PREFIX = """You are a Socratic mentor who guides learners through critical thinking and reflection.
+Your role is to ask thought-provoking questions rather than give direct answers.
 
-Problem: {problem_description}
+For the problem or topic given at the end, provide:
+- questions: 3-5 open-ended questions that help the learner explore the problem deeply
+- reflections: 2-3 prompts that encourage self-reflection and analysis
+- challenges: 2-3 challenging perspectives or assumptions to examine
+- next_steps: suggested thinking exercises or exploration activities
+
+Remember: Ask questions, don't provide solutions. Guide discovery through inquiry.
 """
-        
-        if category:
-            prompt += f"Category: {category}\n"
-        
-        prompt += f"""
-Template Type: {template_type.upper().replace('_', ' ')}
+
+_CT_TAIL_TMPL = """
+Problem/Topic: {problem}
+{context_block}"""
+
+_SOL_PREFIX_TMPL = """You are a solution-oriented mentor helping create practical frameworks.
+
+Template Type: {template_title}
 
 {instruction}
+Fill "template" with a list of items for each section above, "implementation_guide"
+with a step-by-step guide to use this template, and "tips" with 3-5 actionable
+tips for success.
+
+Tailor all sections specifically to the problem described below.
+"""
+
+_SOL_TAIL_TMPL = """
+Problem: {problem}
+{category_block}"""
 
-IMPLEMENTATION GUIDE:
-[Step-by-step guide to use this template]
+_BATCH_SOL_PREFIX_TMPL = """You are a solution-oriented mentor helping create practical frameworks.
 
-PRACTICAL TIPS:
-[3-5 actionable tips for success]
+Produce one template for each numbered problem at the end of this prompt.
+Template Type: {template_title}
 
-Tailor all sections specifically to the problem described above.
+Follow this structure for each template:
+{instruction}
+For every problem fill "template" with a list of items for each section above,
+"implementation_guide" with a step-by-step guide to use the template, and "tips"
+with 3-5 actionable tips.
+
+Return one object per problem, in the same order as the problems.
+Tailor every template specifically to its own problem.
 """
+
+
+def _build_static_prefix(prefix_tmpl: str, template_type: str) -> str:
+    instruction = _TEMPLATE_INSTRUCTIONS.get(template_type, _TEMPLATE_INSTRUCTIONS['action_plan'])
+    return prefix_tmpl.format(
+        template_title=template_type.upper().replace('_', ' '),
+        instruction=instruction
+    )
+
+
+_SOL_STATIC_PREFIXES = {
+    template_type: _build_static_prefix(_SOL_PREFIX_TMPL, template_type)
+    for template_type in _TEMPLATE_INSTRUCTIONS
+}
+
+_BATCH_SOL_STATIC_PREFIXES = {
+    template_type: _build_static_prefix(_BATCH_SOL_PREFIX_TMPL, template_type)
+    for template_type in _TEMPLATE_INSTRUCTIONS
+}
+
+
+# Structured output schemas; Gemini returns JSON matching these, so responses
+# are decoded with a single json.loads instead of hand-written section parsers
+_STRING_LIST = {'type': 'ARRAY', 'items': {'type': 'STRING'}}
+
+_SOCRATIC_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'questions': _STRING_LIST,
+        'reflections': _STRING_LIST,
+        'challenges': _STRING_LIST,
+        'next_steps': _STRING_LIST
+    },
+    'required': ['questions', 'reflections', 'challenges', 'next_steps']
+}
+
+# Section headers of each template, e.g. 'swot' -> ['STRENGTHS', ...]
+_TEMPLATE_SECTIONS = {
+    template_type: re.findall(r'^([A-Z][A-Z/ -]+):$', instruction, re.MULTILINE)
+    for template_type, instruction in _TEMPLATE_INSTRUCTIONS.items()
+}
+
+
+def _solution_schema(template_type: str) -> Dict:
+    sections = _TEMPLATE_SECTIONS.get(template_type, _TEMPLATE_SECTIONS['action_plan'])
+    return {
+        'type': 'OBJECT',
+        'properties': {
+            'template': {
+                'type': 'OBJECT',
+                'properties': {section: _STRING_LIST for section in sections},
+                'required': sections
+            },
+            'implementation_guide': {'type': 'STRING'},
+            'tips': _STRING_LIST
+        },
+        'required': ['template', 'implementation_guide', 'tips']
+    }
+
+
+def _json_config(schema: Dict) -> genai.GenerationConfig:
+    return genai.GenerationConfig(
+        response_mime_type='application/json',
+        response_schema=schema
+    )
+
+
+_SOCRATIC_CONFIG = _json_config(_SOCRATIC_SCHEMA)
+
+_SOLUTION_CONFIGS = {
+    template_type: _json_config(_solution_schema(template_type))
+    for template_type in _TEMPLATE_INSTRUCTIONS
+}
+
+_BATCH_SOLUTION_CONFIGS = {
+    template_type: _json_config({'type': 'ARRAY', 'items': _solution_schema(template_type)})
+    for template_type in _TEMPLATE_INSTRUCTIONS
+}
+
+
+def _batch_solution_config(template_type: str) -> genai.GenerationConfig:
+    return _BATCH_SOLUTION_CONFIGS.get(template_type) or \
+        _json_config({'type': 'ARRAY', 'items': _solution_schema(template_type)})
+
+
+def _decode_batch_items(response: str, expected: int) -> List[Dict]:
+    """Decode a batched reply, raising ValueError unless it has one object per problem"""
+    items = json.loads(response)
+    if not isinstance(items, list) or len(items) != expected:
+        raise ValueError("Batch response does not match the number of problems")
+    if not all(isinstance(item, dict) for item in items):
+        raise ValueError("Batch response items are not JSON objects")
+    return items
+
+
+# Terminal states of a Gemini Batch API job
+_BATCH_DONE_STATES = {
+    'JOB_STATE_SUCCEEDED',
+    'JOB_STATE_FAILED',
+    'JOB_STATE_CANCELLED',
+    'JOB_STATE_EXPIRED'
+}
+
+
+def _decode_object(response: str) -> Dict:
+    """Decode a structured response, raising ValueError unless it is a JSON object"""
+    parsed = json.loads(response)
+    if not isinstance(parsed, dict):
+        raise ValueError("Response is not a JSON object")
+    return parsed
+
+
+def _is_json_object(response: str) -> bool:
+    """True if a structured response decodes to a JSON object"""
+    try:
+        _decode_object(response)
+        return True
+    except ValueError:
+        return False
+
+
+class AIMentor:
+    """AI Mentor providing guidance through critical thinking and solution templates"""
+    
+    def __init__(self, api_key: Optional[str] = None):
+        self.api_key = api_key or Config.GEMINI_API_KEY
+        self.model = get_model(self.api_key, Config.TEXT_MODEL)
+        self.model_fast = get_model(self.api_key, Config.FAST_MODEL)
+        self.conversation_history = deque(maxlen=Config.MAX_HISTORY)
+        # Preformatted "Role: content" lines for the prompt's history window
+        self._history_lines = deque(maxlen=_PROMPT_HISTORY_WINDOW)
+        self.cache = ResponseCache(maxsize=Config.CACHE_MAX_ENTRIES, ttl=Config.CACHE_TTL)
+        self.semantic_cache = SemanticCache(threshold=Config.SEMANTIC_CACHE_THRESHOLD)
+        self.stats = {'cache_hits': 0, 'semantic_hits': 0, 'cache_misses': 0, 'fallbacks': 0}
+    
+    def critical_thinking_mode(self, problem_description: str, 
+                              context: Optional[str] = None) -> Dict:
+        request = self._critical_thinking_request(problem_description, context)
         
-        return prompt
+        try:
+            parsed, result, from_cache = self._generate_cached(**request)
+            return self._critical_thinking_result(problem_description, parsed, result, from_cache)
+            
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e),
+                'mode': 'Critical Thinking'
+            }
     
-    def _create_interactive_prompt(self, user_message: str, mode: str) -> str:
-        """Create prompt for interactive conversation"""
+    async def critical_thinking_mode_async(self, problem_description: str,
+                                           context: Optional[str] = None) -> Dict:
+        """Async variant of critical_thinking_mode for concurrent callers"""
+        request = self._critical_thinking_request(problem_description, context)
         
-        history_context = ""
-        if self.conversation_history:
-            history_context = "\nConversation history:\n"
-            for entry in self.conversation_history[-4:]:  # Last 4 messages
-                role = entry['role'].title()
-                history_context += f"{role}: {entry['content']}\n"
-        
-        if mode == 'critical_thinking':
-            system_role = """You are a Socratic mentor. Continue guiding through questions.
-Ask probing questions, encourage reflection, challenge assumptions."""
-        else:
-            system_role = """You are a solution-focused mentor. Provide practical frameworks,
-actionable advice, and concrete next steps."""
+        try:
+            parsed, result, from_cache = await self._generate_cached_async(**request)
+            return self._critical_thinking_result(problem_description, parsed, result, from_cache)
+            
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e),
+                'mode': 'Critical Thinking'
+            }
+    
+    async def batch_critical_thinking(self, problems: List[str],
+                                      context: Optional[str] = None) -> List[Dict]:
+        """Run critical thinking mode for independent problems concurrently"""
+        semaphore = asyncio.Semaphore(Config.MAX_CONCURRENT)
         
-        prompt = f"""{system_role}
-{history_context}
-
-User: {user_message}
-
-Mentor response:"""
+        async def run(problem: str) -> Dict:
+            async with semaphore:
+                return await self.critical_thinking_mode_async(problem, context)
         
-        return prompt
+        return await asyncio.gather(*(run(problem) for problem in problems))
     
-    def _determine_template_type(self, problem_description: str, 
-                                 category: Optional[str] = None) -> str:
-        """Automatically determine best template type"""
-        desc_lower = problem_description.lower()
+    def solution_mode(self, problem_description: str, 
+                     template_type: str = 'auto',
+                     category: Optional[str] = None) -> Dict:
+        template_type, request = self._solution_request(
+            problem_description, template_type, category
+        )
         
-        # Keywords for different templates
-        if any(word in desc_lower for word in ['budget', 'cost', 'funding', 'money', 'finance']):
-            return 'budget'
-        elif any(word in desc_lower for word in ['stakeholder', 'community', 'people', 'involve']):
-            return 'stakeholder'
-        elif any(word in desc_lower for word in ['timeline', 'schedule', 'when', 'deadline']):
-            return 'timeline'
-        elif any(word in desc_lower for word in ['strength', 'weakness', 'opportunity', 'threat', 'analyze']):
-            return 'swot'
-        else:
-            return 'action_plan'  # Default
-    
-    def _parse_socratic_response(self, response: str) -> Dict:
-        """Parse Socratic questioning response"""
-        parsed = {}
-        
-        sections = {
-            'questions': ['GUIDING QUESTIONS:', 'Guiding Questions:'],
-            'reflections': ['REFLECTION PROMPTS:', 'Reflection Prompts:'],
-            'challenges': ['CHALLENGE POINTS:', 'Challenge Points:'],
-            'next_steps': ['NEXT STEPS:', 'Next Steps:']
-        }
+        try:
+            parsed, result, from_cache = self._generate_cached(**request)
+            return self._solution_result(
+                problem_description, template_type, parsed, result, from_cache
+            )
+            
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e),
+                'mode': 'Solution'
+            }
+    
+    async def solution_mode_async(self, problem_description: str,
+                                  template_type: str = 'auto',
+                                  category: Optional[str] = None) -> Dict:
+        """Async variant of solution_mode for concurrent callers"""
+        template_type, request = self._solution_request(
+            problem_description, template_type, category
+        )
+        
+        try:
+            parsed, result, from_cache = await self._generate_cached_async(**request)
+            return self._solution_result(
+                problem_description, template_type, parsed, result, from_cache
+            )
+            
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e),
+                'mode': 'Solution'
+            }
+    
+    def solution_mode_batch(self, problems: List[str],
+                            template_type: str = 'auto',
+                            category: Optional[str] = None) -> List[Dict]:
+        """Generate solution templates for many problems with one Gemini call per batch.
+        
+        Use this for offline workloads; for a few latency-sensitive calls
+        prefer concurrent solution_mode_async. Problems already in the
+        response cache are served from it; see _plan_solution_batches for
+        how the rest are grouped.
+        """
+        results, pending = self._cached_solutions(problems, template_type, category)
+        
+        for resolved, chunk in self._plan_solution_batches(
+                problems, pending, template_type, category):
+            chunk_results = self._solution_batch_call(
+                [problems[i] for i in chunk], resolved, category
+            )
+            for index, result in zip(chunk, chunk_results):
+                results[index] = result
+        
+        return results
+    
+    async def solution_mode_batch_async(self, problems: List[str],
+                                        template_type: str = 'auto',
+                                        category: Optional[str] = None) -> List[Dict]:
+        """Async variant of solution_mode_batch that sends all batches concurrently"""
+        results, pending = self._cached_solutions(problems, template_type, category)
+        semaphore = asyncio.Semaphore(Config.MAX_CONCURRENT)
         
-        for key, headers in sections.items():
-            for header in headers:
-                if header in response:
-                    content = self._extract_section_content(response, header, sections)
-                    parsed[key] = self._parse_list_items(content)
-                    break
+        async def run(resolved: str, chunk: List[int]):
+            async with semaphore:
+                chunk_results = await self._solution_batch_call_async(
+                    [problems[i] for i in chunk], resolved, category
+                )
+            for index, result in zip(chunk, chunk_results):
+                results[index] = result
         
-        return parsed
+        batches = self._plan_solution_batches(problems, pending, template_type, category)
+        await asyncio.gather(*(run(resolved, chunk) for resolved, chunk in batches))
+        return results
     
-    def _parse_template_response(self, response: str, template_type: str) -> Dict:
-        """Parse template response"""
-        parsed = {}
+    def solution_mode_batch_offline(self, problems: List[str],
+                                    template_type: str = 'auto',
+                                    out_path: str = 'solution_batch.jsonl',
+                                    category: Optional[str] = None) -> Dict:
+        """Run solution mode over a large offline workload with the Gemini Batch API.
+        
+        Writes one request per problem to `out_path` (JSONL), submits it as a
+        batch job, waits for it and parses the results locally. Batch jobs
+        cost about half as much as live calls but can take hours, so use this
+        only for bulk jobs. Needs the optional google-genai package; without
+        it, submit `out_path` yourself and call parse_solution_batch_results.
+        """
+        requests = self.write_solution_batch_file(problems, template_type, out_path, category)
         
-        # Extract template structure (everything before IMPLEMENTATION GUIDE)
-        if 'IMPLEMENTATION GUIDE:' in response:
-            template_text = response.split('IMPLEMENTATION GUIDE:')[0]
-            guide_and_rest = response.split('IMPLEMENTATION GUIDE:')[1]
+        try:
+            from google import genai as google_genai
+        except ImportError:
+            return {
+                'success': False,
+                'error': "The google-genai package is required to submit batch jobs",
+                'batch_file': out_path
+            }
+        
+        try:
+            client = google_genai.Client(api_key=self.api_key)
+            uploaded = client.files.upload(
+                file=out_path,
+                config={'display_name': os.path.basename(out_path), 'mime_type': 'jsonl'}
+            )
+            job = client.batches.create(
+                model=Config.TEXT_MODEL,
+                src=uploaded.name,
+                config={'display_name': os.path.basename(out_path)}
+            )
             
-            parsed['template'] = self._parse_template_structure(template_text, template_type)
+            while job.state.name not in _BATCH_DONE_STATES:
+                time.sleep(Config.BATCH_POLL_INTERVAL)
+                job = client.batches.get(name=job.name)
             
-            if 'PRACTICAL TIPS:' in guide_and_rest:
-                guide = guide_and_rest.split('PRACTICAL TIPS:')[0].strip()
-                tips = guide_and_rest.split('PRACTICAL TIPS:')[1].strip()
-                parsed['guide'] = guide
-                parsed['tips'] = self._parse_list_items(tips)
-            else:
-                parsed['guide'] = guide_and_rest.strip()
-                parsed['tips'] = []
-        else:
-            parsed['template'] = {'raw': response}
-            parsed['guide'] = ''
-            parsed['tips'] = []
-        
-        return parsed
-    
-    def _parse_template_structure(self, template_text: str, template_type: str) -> Dict:
-        """Parse template into structured format"""
-        lines = template_text.split('\n')
-        structure = {}
-        current_section = None
-        
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
+            if job.state.name != 'JOB_STATE_SUCCEEDED':
+                raise RuntimeError(f"Batch job {job.name} ended in state {job.state.name}")
             
-            # Check if it's a header (all caps with colon)
-            if line.isupper() and ':' in line:
-                current_section = line.replace(':', '').strip()
-                structure[current_section] = []
-            elif current_section:
-                structure[current_section].append(line)
-        
-        return structure
-    
-    def _extract_section_content(self, response: str, header: str, 
-                                 all_sections: Dict) -> str:
-        """Extract content between section headers"""
-        start_idx = response.find(header) + len(header)
-        
-        # Find next section header
-        end_idx = len(response)
-        for section_headers in all_sections.values():
-            for other_header in section_headers:
-                if other_header != header and other_header in response[start_idx:]:
-                    idx = response.find(other_header, start_idx)
-                    if idx < end_idx:
-                        end_idx = idx
-        
-        return response[start_idx:end_idx].strip()
-    
-    def _parse_list_items(self, text: str) -> List[str]:
-        """Parse text into list items"""
-        items = []
-        for line in text.split('\n'):
-            line = line.strip()
-            if not line:
+            output = client.files.download(file=job.dest.file_name).decode('utf-8')
+            
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e),
+                'batch_file': out_path
+            }
+        
+        return {
+            'success': True,
+            'batch_file': out_path,
+            'job_name': job.name,
+            'results': self.parse_solution_batch_results(output.splitlines(), requests)
+        }
+    
+    def write_solution_batch_file(self, problems: List[str], template_type: str,
+                                  out_path: str,
+                                  category: Optional[str] = None) -> List[Dict]:
+        """Write one Batch API request line per problem; returns the per-line requests"""
+        requests = []
+        
+        with open(out_path, 'w', encoding='utf-8') as f:
+            for index, problem in enumerate(problems):
+                resolved, request = self._solution_request(problem, template_type, category)
+                request['template_type'] = resolved
+                requests.append(request)
+                
+                line = {
+                    'key': str(index),
+                    'request': {
+                        'contents': [{'role': 'user', 'parts': [{'text': request['prompt']}]}],
+                        'generation_config': {
+                            'response_mime_type': 'application/json',
+                            'response_schema': _solution_schema(resolved)
+                        }
+                    }
+                }
+                f.write(json.dumps(line) + '\n')
+        
+        return requests
+    
+    def parse_solution_batch_results(self, lines: List[str],
+                                     requests: List[Dict]) -> List[Dict]:
+        """Turn Batch API output lines back into solution_mode results, in input order.
+        
+        Successful responses are also added to the response cache. A line
+        that fails gets an error result for its request; if the line cannot
+        even be matched to a request, its error is appended to the message
+        of every request left without a result.
+        """
+        missing = 'No result in batch output'
+        results = [
+            {'success': False, 'error': missing, 'mode': 'Solution'}
+            for _ in requests
+        ]
+        unmatched = []
+        
+        for line_number, line in enumerate(lines, 1):
+            if not line.strip():
                 continue
-            # Remove bullet points, numbers, dashes
-            line = line.lstrip('•-–—*►▪▫').strip()
-            if line and line[0].isdigit() and '.' in line[:3]:
-                line = line.split('.', 1)[1].strip()
-            if line:
-                items.append(line)
-        return items
+            
+            index = None
+            try:
+                entry = json.loads(line)
+                index = int(entry['key'])
+                if not 0 <= index < len(requests):
+                    index = None
+                    raise IndexError(f"key {entry['key']} matches no request")
+                request = requests[index]
+                
+                if 'error' in entry:
+                    raise RuntimeError(entry['error'].get('message', str(entry['error'])))
+                
+                parts = entry['response']['candidates'][0]['content']['parts']
+                result = ''.join(part.get('text', '') for part in parts)
+                results[index] = self._solution_result(
+                    request['problem_description'], request['template_type'],
+                    _decode_object(result), result, False
+                )
+                self._cache_store(request['cache_key'], request['namespace'], None, result)
+                
+            except Exception as e:
+                if index is None:
+                    unmatched.append(f"line {line_number}: {e!r}")
+                    continue
+                results[index] = {
+                    'success': False,
+                    'error': str(e),
+                    'mode': 'Solution'
+                }
+        
+        if unmatched:
+            error = f"{missing} (unreadable lines: {'; '.join(unmatched)})"
+            for result in results:
+                if result.get('error') == missing:
+                    result['error'] = error
+        
+        return results
+    
+    def interactive_mentoring(self, user_message: str, 
+                            mode: str = 'critical_thinking') -> Dict:
+
+        # Add user message to history
+        self._add_to_history('user', user_message)
+        
+        # Create context-aware prompt
+        prompt = self._create_interactive_prompt(user_message, mode)
+        
+        try:
+            result = self._generate(prompt, self._select_chat_model(user_message, mode))
+            return self._interactive_result(user_message, mode, result)
+            
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e),
+                'mode': mode
+            }
+    
+    async def interactive_mentoring_async(self, user_message: str,
+                                          mode: str = 'critical_thinking') -> Dict:
+        """Async variant of interactive_mentoring"""
+        self._add_to_history('user', user_message)
+        
+        prompt = self._create_interactive_prompt(user_message, mode)
+        
+        try:
+            model = self._select_chat_model(user_message, mode)
+            result = await self._generate_async(prompt, model)
+            return self._interactive_result(user_message, mode, result)
+            
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e),
+                'mode': mode
+            }
+    
+    async def interactive_mentoring_stream(self, user_message: str,
+                                           mode: str = 'critical_thinking') -> AsyncIterator[str]:
+        """Stream the mentor reply chunk by chunk as Gemini generates it.
+        
+        The completed reply is added to the conversation history once the
+        stream closes. Errors propagate to the caller; a partial reply is not
+        recorded and the user message is taken back out of the history.
+        """
+        self._add_to_history('user', user_message)
+        prompt = self._create_interactive_prompt(user_message, mode)
+        
+        chunks = []
+        try:
+            model = self._select_chat_model(user_message, mode)
+            response = await generate_async(model, prompt, stream=True)
+            async for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # A chunk without text parts, e.g. only a finish reason
+                    continue
+                chunks.append(text)
+                yield text
+            
+            if not chunks:
+                raise ValueError("Mentor reply has no text")
+        except BaseException:
+            # Also covers a stream the caller abandons (GeneratorExit)
+            self._pop_history()
+            raise
+        
+        self._add_to_history('mentor', ''.join(chunks))
+    
+    def new_session(self) -> 'AIMentor':
+        """Return a mentor with its own conversation that shares this one's clients and caches"""
+        session = copy.copy(self)
+        session.conversation_history = deque(maxlen=Config.MAX_HISTORY)
+        session._history_lines = deque(maxlen=_PROMPT_HISTORY_WINDOW)
+        return session
+    
+    def reset_conversation(self):
+        """Clear conversation history"""
+        self.conversation_history.clear()
+        self._history_lines.clear()
+    
+    def _add_to_history(self, role: str, content: str):
+        self.conversation_history.append({
+            'role': role,
+            'content': content
+        })
+        self._history_lines.append(self._history_line(role, content))
+    
+    def _pop_history(self):
+        """Drop the latest turn, e.g. a user message left without a reply.
+        
+        The prompt window is rebuilt from the tail of the history, so the
+        line it evicted when that turn was added comes back.
+        """
+        self.conversation_history.pop()
+        self._history_lines.clear()
+        # The window's maxlen keeps only the last _PROMPT_HISTORY_WINDOW lines
+        self._history_lines.extend(
+            self._history_line(turn['role'], turn['content'])
+            for turn in self.conversation_history
+        )
+    
+    @staticmethod
+    def _history_line(role: str, content: str) -> str:
+        return f"{role.title()}: {content}"
+    
+    def _select_model(self, problem_description: str, template_type: str):
+        """Route short problems with simple templates to the cheaper fast model"""
+        if (len(problem_description) < Config.FAST_MODEL_MAX_CHARS and
+                template_type in Config.FAST_MODEL_TEMPLATES):
+            return self.model_fast
+        return self.model
+    
+    def _select_chat_model(self, user_message: str, mode: str):
+        """Short solution-focused chat turns go to the fast model"""
+        if mode != 'critical_thinking' and len(user_message) < Config.FAST_MODEL_MAX_CHARS:
+            return self.model_fast
+        return self.model
+    
+    def _critical_thinking_request(self, problem_description: str,
+                                   context: Optional[str]) -> Dict:
+        """Build the prompt and cache identifiers for critical thinking mode"""
+        return {
+            'prompt': self._create_critical_thinking_prompt(problem_description, context),
+            'cache_key': make_cache_key(
+                mode='critical_thinking',
+                problem=problem_description,
+                context=context
+            ),
+            'namespace': ('critical_thinking', context),
+            'problem_description': problem_description,
+            'generation_config': _SOCRATIC_CONFIG
+        }
+    
+    def _solution_request(self, problem_description: str, template_type: str,
+                          category: Optional[str]) -> Tuple[str, Dict]:
+        """Resolve the template type and build the prompt and cache identifiers"""
+        # Determine best template if auto
+        if template_type == 'auto':
+            template_type = self._determine_template_type(problem_description, category)
+        
+        request = {
+            'prompt': self._create_solution_template_prompt(
+                problem_description,
+                template_type,
+                category
+            ),
+            'cache_key': self._solution_cache_key(problem_description, template_type, category),
+            'namespace': ('solution', template_type, category),
+            'problem_description': problem_description,
+            'generation_config': _SOLUTION_CONFIGS.get(template_type) or
+                                 _json_config(_solution_schema(template_type)),
+            'model': self._select_model(problem_description, template_type),
+            'validate': _is_json_object
+        }
+        return template_type, request
+    
+    @staticmethod
+    def _solution_cache_key(problem_description: str, template_type: str,
+                            category: Optional[str]) -> str:
+        return make_cache_key(
+            mode='solution',
+            tmpl=template_type,
+            cat=category,
+            problem=problem_description
+        )
+    
+    def _cached_solutions(self, problems: List[str], template_type: str,
+                          category: Optional[str]) -> Tuple[List[Optional[Dict]], List[int]]:
+        """Serve what the response cache holds; returns (results, indices still to generate)"""
+        results, pending = [None] * len(problems), []
+        
+        for index, problem in enumerate(problems):
+            resolved = template_type
+            if resolved == 'auto':
+                resolved = self._determine_template_type(problem, category)
+            
+            cached = self._cache_lookup(self._solution_cache_key(problem, resolved, category))
+            if cached is not None:
+                try:
+                    results[index] = self._solution_result(
+                        problem, resolved, _decode_object(cached), cached, True
+                    )
+                    continue
+                except ValueError:
+                    pass
+            pending.append(index)
+        
+        return results, pending
+    
+    def _plan_solution_batches(self, problems: List[str], indices: List[int],
+                               template_type: str,
+                               category: Optional[str]) -> List[Tuple[str, List[int]]]:
+        """Split the given problem indices into (template_type, indices) batches.
+        
+        Problems are binned by template type and by length in steps of
+        Config.BATCH_LENGTH_BUCKET characters. A short problem then never
+        shares a request with a much longer one, which avoids padding waste.
+        Each bin is cut into batches of at most Config.BATCH_PROMPT_SIZE.
+        """
+        bins = {}
+        for index in indices:
+            problem = problems[index]
+            resolved = template_type
+            if resolved == 'auto':
+                resolved = self._determine_template_type(problem, category)
+            length_bucket = len(problem) // Config.BATCH_LENGTH_BUCKET
+            bins.setdefault((resolved, length_bucket), []).append(index)
+        
+        batch_size = Config.BATCH_PROMPT_SIZE
+        return [
+            (resolved, indices[start:start + batch_size])
+            for (resolved, _), indices in sorted(bins.items())
+            for start in range(0, len(indices), batch_size)
+        ]
+    
+    def _solution_batch_call(self, problems: List[str], template_type: str,
+                             category: Optional[str]) -> List[Dict]:
+        """Send one batched prompt; fall back to per-problem calls if the reply is unusable"""
+        prompt = self._create_batch_solution_prompt(problems, template_type, category)
+        
+        try:
+            result = self._generate(prompt, generation_config=_batch_solution_config(template_type))
+            items = _decode_batch_items(result, len(problems))
+        except Exception:
+            return [self.solution_mode(problem, template_type, category)
+                    for problem in problems]
+        
+        return self._store_batch_items(problems, template_type, category, items)
+    
+    async def _solution_batch_call_async(self, problems: List[str], template_type: str,
+                                         category: Optional[str]) -> List[Dict]:
+        """Async variant of _solution_batch_call"""
+        prompt = self._create_batch_solution_prompt(problems, template_type, category)
+        
+        try:
+            result = await self._generate_async(
+                prompt, generation_config=_batch_solution_config(template_type)
+            )
+            items = _decode_batch_items(result, len(problems))
+        except Exception:
+            return await asyncio.gather(*(
+                self.solution_mode_async(problem, template_type, category)
+                for problem in problems
+            ))
+        
+        return self._store_batch_items(problems, template_type, category, items)
+    
+    def _store_batch_items(self, problems: List[str], template_type: str,
+                           category: Optional[str], items: List[Dict]) -> List[Dict]:
+        """Cache each decoded batch item under its own problem's key and shape the results"""
+        results = []
+        for problem, item in zip(problems, items):
+            result = json.dumps(item)
+            self._cache_store(
+                self._solution_cache_key(problem, template_type, category),
+                ('solution', template_type, category), None, result
+            )
+            results.append(self._solution_result(problem, template_type, item, result, False))
+        return results
+    
+    def _critical_thinking_result(self, problem_description: str, parsed: Dict,
+                                  result: str, from_cache: bool) -> Dict:
+        return {
+            'success': True,
+            'mode': 'Critical Thinking',
+            'problem': problem_description,
+            'guiding_questions': parsed.get('questions', []),
+            'reflection_prompts': parsed.get('reflections', []),
+            'challenge_points': parsed.get('challenges', []),
+            'next_steps': parsed.get('next_steps', []),
+            'full_response': result,
+            'from_cache': from_cache
+        }
+    
+    def _solution_result(self, problem_description: str, template_type: str,
+                         parsed: Dict, full_response: str, from_cache: bool) -> Dict:
+        return {
+            'success': True,
+            'mode': 'Solution',
+            'template_type': template_type,
+            'problem': problem_description,
+            'template': parsed.get('template', {}),
+            'implementation_guide': parsed.get('implementation_guide', ''),
+            'tips': parsed.get('tips', []),
+            'full_response': full_response,
+            'from_cache': from_cache
+        }
+    
+    def _interactive_result(self, user_message: str, mode: str,
+                            mentor_response: str) -> Dict:
+        # Add mentor response to history
+        self._add_to_history('mentor', mentor_response)
+        
+        return {
+            'success': True,
+            'mode': mode,
+            'user_message': user_message,
+            'mentor_response': mentor_response,
+            'conversation_length': len(self.conversation_history)
+        }
+    
+    def _generate_cached(self, cache_key: str, prompt: str, namespace: Tuple,
+                         problem_description: str, generation_config=None, model=None,
+                         validate: Optional[Callable[[str], bool]] = None
+                         ) -> Tuple[Dict, str, bool]:
+        """Return (decoded_object, response_text, from_cache), calling Gemini only on a cache miss.
+        
+        If a non-default model's reply fails `validate`, it is regenerated
+        with the default model. Only replies that decode to a JSON object are
+        cached; anything else raises ValueError, so a truncated reply is
+        retried on the next call instead of being served from the cache.
+        """
+        model = model or self.model
+        cached = self._cache_lookup(cache_key)
+        if cached is not None:
+            return _decode_object(cached), cached, True
+        
+        embedding = embed_text(problem_description)
+        cached = self._semantic_lookup(cache_key, namespace, embedding)
+        if cached is not None:
+            return _decode_object(cached), cached, True
+        
+        self.stats['cache_misses'] += 1
+        result = self._generate(prompt, model, generation_config)
+        if validate and model is not self.model and not validate(result):
+            self.stats['fallbacks'] += 1
+            result = self._generate(prompt, self.model, generation_config)
+        parsed = _decode_object(result)
+        self._cache_store(cache_key, namespace, embedding, result)
+        return parsed, result, False
+    
+    async def _generate_cached_async(self, cache_key: str, prompt: str, namespace: Tuple,
+                                     problem_description: str, generation_config=None,
+                                     model=None,
+                                     validate: Optional[Callable[[str], bool]] = None
+                                     ) -> Tuple[Dict, str, bool]:
+        """Async variant of _generate_cached"""
+        model = model or self.model
+        cached = self._cache_lookup(cache_key)
+        if cached is not None:
+            return _decode_object(cached), cached, True
+        
+        embedding = await embed_text_async(problem_description)
+        cached = self._semantic_lookup(cache_key, namespace, embedding)
+        if cached is not None:
+            return _decode_object(cached), cached, True
+        
+        self.stats['cache_misses'] += 1
+        result = await self._generate_async(prompt, model, generation_config)
+        if validate and model is not self.model and not validate(result):
+            self.stats['fallbacks'] += 1
+            result = await self._generate_async(prompt, self.model, generation_config)
+        parsed = _decode_object(result)
+        self._cache_store(cache_key, namespace, embedding, result)
+        return parsed, result, False
+    
+    def _generate(self, prompt: str, model=None, generation_config=None) -> str:
+        """Call Gemini under the shared rate limit, retrying transient errors (429/5xx)"""
+        return generate(model or self.model, prompt, generation_config=generation_config).text
+    
+    async def _generate_async(self, prompt: str, model=None, generation_config=None) -> str:
+        """Async variant of _generate"""
+        response = await generate_async(
+            model or self.model, prompt, generation_config=generation_config
+        )
+        return response.text
+    
+    def _cache_lookup(self, cache_key: str) -> Optional[str]:
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            self.stats['cache_hits'] += 1
+        return cached
+    
+    def _semantic_lookup(self, cache_key: str, namespace: Tuple,
+                         embedding: Optional[List[float]]) -> Optional[str]:
+        # Near-duplicate problems within the same mode/template reuse a response
+        if embedding is None:
+            return None
+        
+        cached = self.semantic_cache.lookup(namespace, embedding)
+        if cached is not None:
+            self.stats['semantic_hits'] += 1
+            self.cache.set(cache_key, cached)
+        return cached
+    
+    def _cache_store(self, cache_key: str, namespace: Tuple,
+                     embedding: Optional[List[float]], result: str):
+        self.cache.set(cache_key, result)
+        if embedding is not None:
+            self.semantic_cache.add(namespace, embedding, result)
+    
+    def _create_critical_thinking_prompt(self, problem_description: str, 
+                                        context: Optional[str] = None) -> str:
+        """Create prompt for critical thinking mode"""
+        context_block = f"\nContext: {context}\n" if context else ""
+        return _CT_STATIC_PREFIX + _CT_TAIL_TMPL.format(
+            problem=problem_description,
+            context_block=context_block
+        )
+    
+    def _create_solution_template_prompt(self, problem_description: str, 
+                                        template_type: str,
+                                        category: Optional[str] = None) -> str:
+        """Create prompt for solution template generation"""
+        prefix = _SOL_STATIC_PREFIXES.get(template_type) or \
+            _build_static_prefix(_SOL_PREFIX_TMPL, template_type)
+        category_block = f"Category: {category}\n" if category else ""
+        return prefix + _SOL_TAIL_TMPL.format(
+            problem=problem_description,
+            category_block=category_block
+        )
+    
+    def _create_batch_solution_prompt(self, problems: List[str], template_type: str,
+                                      category: Optional[str] = None) -> str:
+        """Create a single prompt asking for one template per numbered problem"""
+        prefix = _BATCH_SOL_STATIC_PREFIXES.get(template_type) or \
+            _build_static_prefix(_BATCH_SOL_PREFIX_TMPL, template_type)
+        numbered = '\n'.join(
+            f"Problem {i}: {problem}" for i, problem in enumerate(problems, 1)
+        )
+        category_line = f"Category: {category}\n" if category else ""
+        
+        return f"{prefix}\n{category_line}There are {len(problems)} problems.\n\n{numbered}\n"
+    
+    def _create_interactive_prompt(self, user_message: str, mode: str) -> str:
+        """Create prompt for interactive conversation"""
+        system_role = _CHAT_SYSTEM_ROLES['critical_thinking' if mode == 'critical_thinking'
+                                          else 'solution']
+        
+        parts = [system_role]
+        if self._history_lines:
+            parts += ["", "Conversation history:", *self._history_lines]
+        parts += ["", "", f"User: {user_message}", "", "Mentor response:"]
+        
+        return "\n".join(parts)
+    
+    def _determine_template_type(self, problem_description: str, 
+                                 category: Optional[str] = None) -> str:
+        """Automatically determine best template type"""
+        desc_lower = problem_description.lower()
+        
+        # One pass over the text; keep the highest-priority template seen
+        best = None
+        for match in _TEMPLATE_KEYWORD_RE.finditer(desc_lower):
+            priority, template = _KEYWORD_TEMPLATES[match.group(0)]
+            if priority == 0:
+                return template
+            if best is None or priority < best[0]:
+                best = (priority, template)
+        
+        return best[1] if best else 'action_plan'  # Default
 
 
 # Convenience functions
+_DEFAULT_MENTOR: Optional[AIMentor] = None
+
+
+def _get_default_mentor() -> AIMentor:
+    """Lazily create the shared mentor used by the convenience functions"""
+    global _DEFAULT_MENTOR
+    _DEFAULT_MENTOR = _DEFAULT_MENTOR or AIMentor()
+    return _DEFAULT_MENTOR
+
+
 def get_critical_thinking_guidance(problem: str, context: Optional[str] = None) -> Dict:
     """Get Socratic guidance for critical thinking"""
-    mentor = AIMentor()
-    return mentor.critical_thinking_mode(problem, context)
+    return _get_default_mentor().critical_thinking_mode(problem, context)
 
 
 def get_solution_template(problem: str, template_type: str = 'auto', 
                           category: Optional[str] = None) -> Dict:
     """Get solution template and framework"""
-    mentor = AIMentor()
-    return mentor.solution_mode(problem, template_type, category)
+    return _get_default_mentor().solution_mode(problem, template_type, category)
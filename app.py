@@ -1,13 +1,17 @@
 import streamlit as st
 from PIL import Image
-import io
 import base64
+from types import MappingProxyType
 from typing import Optional
 
 from integrated_system import AILearningPlatform
 from ai_mentor import AIMentor
+from vision_detector import sniff_mime_type
 from config import Config
 
+# Bound decoded image memory for every PIL open in this process
+Image.MAX_IMAGE_PIXELS = Config.MAX_IMAGE_PIXELS
+
 # Page configuration
 st.set_page_config(
     page_title="Community Issue Analyzer",
@@ -16,8 +20,57 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Custom CSS
-st.markdown("""
+# Category badges shown next to the classification
+_EMOJI_MAP = MappingProxyType({
+    'Environment': '',
+    'Health': '',
+    'Education': ''
+})
+
+# Solution mode template labels -> AIMentor template types
+_TEMPLATE_MAP = MappingProxyType({
+    "Auto-detect": "auto",
+    "SWOT Analysis": "swot",
+    "Budget Outline": "budget",
+    "Action Plan": "action_plan",
+    "Stakeholder Analysis": "stakeholder",
+    "Project Timeline": "timeline"
+})
+
+
+@st.cache_resource
+def get_platform() -> AILearningPlatform:
+    """One platform (and its Gemini clients) shared by every session"""
+    return AILearningPlatform()
+
+
+@st.cache_resource
+def get_mentor() -> AIMentor:
+    """One mentor client shared by every session; use new_session() for per-user chat"""
+    return AIMentor()
+
+
+# Initialize session state
+if 'platform' not in st.session_state:
+    try:
+        st.session_state.platform = get_platform()
+        st.session_state.api_configured = True
+    except ValueError as e:
+        st.session_state.api_configured = False
+        st.session_state.error_message = str(e)
+
+if 'mentor' not in st.session_state:
+    try:
+        st.session_state.mentor = get_mentor().new_session()
+    except ValueError:
+        st.session_state.mentor = None
+
+st.session_state.setdefault('analysis_result', None)
+st.session_state.setdefault('mentor_conversation', [])
+
+
+# Custom CSS; a plain string constant, so reruns need no build step or cache lookup
+_CSS = """
 <style>
     .main-header {
         font-size: 2.5rem;
@@ -66,28 +119,7 @@ st.markdown("""
         background-color: #155a8a;
     }
 </style>
-""", unsafe_allow_html=True)
-
-# Initialize session state
-if 'platform' not in st.session_state:
-    try:
-        st.session_state.platform = AILearningPlatform()
-        st.session_state.api_configured = True
-    except ValueError as e:
-        st.session_state.api_configured = False
-        st.session_state.error_message = str(e)
-
-if 'mentor' not in st.session_state:
-    try:
-        st.session_state.mentor = AIMentor()
-    except ValueError:
-        st.session_state.mentor = None
-
-if 'analysis_result' not in st.session_state:
-    st.session_state.analysis_result = None
-
-if 'mentor_conversation' not in st.session_state:
-    st.session_state.mentor_conversation = []
+"""
 
 
 def display_header():
@@ -99,24 +131,44 @@ def display_header():
     )
 
 
+def validate_upload(image_file) -> Optional[str]:
+    """Check size and extension before any decoding; returns an error message or None"""
+    if image_file.size > Config.MAX_IMAGE_SIZE:
+        return f"Image is larger than {Config.MAX_IMAGE_SIZE // (1024 * 1024)}MB"
+    
+    extension = image_file.name.rsplit('.', 1)[-1].lower()
+    if extension not in Config.ALLOWED_EXTENSIONS:
+        return f"Unsupported file type: .{extension}"
+    
+    return None
+
+
 def process_image(image_file, domains):
     """Process uploaded image"""
+    error = validate_upload(image_file)
+    if error:
+        return {'success': False, 'error': error}
+    
     with st.spinner("Analyzing image..."):
-        # Save uploaded file temporarily
-        image = Image.open(image_file)
-        
-        # Convert to bytes for processing
-        img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format=image.format or 'PNG')
-        img_byte_arr = img_byte_arr.getvalue()
-        
-        # Save temporarily
-        temp_path = "/tmp/uploaded_image.jpg"
-        with open(temp_path, "wb") as f:
-            f.write(img_byte_arr)
+        # The upload is already an encoded image, so send its bytes as-is
+        image_bytes = image_file.getvalue()
+        # Trust the file's magic number over the browser-supplied type
+        mime_type = sniff_mime_type(image_bytes) or image_file.type or 'image/png'
         
         # Process with platform
-        result = st.session_state.platform.process_image(temp_path, domains=domains)
+        platform = st.session_state.platform
+        if Config.SINGLE_SHOT_ANALYSIS:
+            return platform.process_image_single_shot(image_bytes, mime_type, domains=domains)
+        
+        # Show the vision analysis as it streams in, while the later steps wait on it
+        preview = st.empty()
+        result = platform.process_image_bytes(
+            image_bytes,
+            mime_type,
+            domains=domains,
+            on_text=preview.markdown
+        )
+        preview.empty()
         
         return result
 
@@ -124,8 +176,10 @@ def process_image(image_file, domains):
 def process_text(problem_description):
     """Process text description"""
     with st.spinner("Processing description..."):
-        result = st.session_state.platform.process_text_description(problem_description)
-        return result
+        platform = st.session_state.platform
+        analyze = (platform.process_text_single_shot if Config.SINGLE_SHOT_ANALYSIS
+                   else platform.process_text_description)
+        return analyze(problem_description)
 
 
 def display_results(result):
@@ -158,12 +212,7 @@ def display_results(result):
         
         with col1:
             category = classification.get('category', 'Unknown')
-            emoji_map = {
-                'Environment': '',
-                'Health': '',
-                'Education': ''
-            }
-            st.metric("Category", f"{emoji_map.get(category, '❓')} {category}")
+            st.metric("Category", f"{_EMOJI_MAP.get(category, '❓')} {category}")
         
         with col2:
             confidence = classification.get('confidence', 'Unknown')
@@ -209,7 +258,7 @@ def display_results(result):
     col1, col2 = st.columns([3, 1])
     with col2:
         # Create download content
-        download_content = f"""
+        parts = [f"""
 # Community Issue Analysis Report
 
 ## Classification
@@ -229,9 +278,12 @@ def display_results(result):
 {result.get('mission_statement', {}).get('expected_impact', 'N/A')}
 
 ## Action Steps
-"""
-        for i, step in enumerate(result.get('mission_statement', {}).get('action_steps', []), 1):
-            download_content += f"{i}. {step}\n"
+"""]
+        parts.extend(
+            f"{i}. {step}\n"
+            for i, step in enumerate(result.get('mission_statement', {}).get('action_steps', []), 1)
+        )
+        download_content = "".join(parts)
         
         st.download_button(
             label="Download Report",
@@ -334,27 +386,16 @@ def display_solution_mode():
     
     template_type = st.selectbox(
         "Select Template Type:",
-        ["Auto-detect", "SWOT Analysis", "Budget Outline", "Action Plan", 
-         "Stakeholder Analysis", "Project Timeline"],
+        list(_TEMPLATE_MAP),
         help="Auto-detect will choose the best template for your problem"
     )
     
     if st.button("Generate Template", key="sol_button"):
         if problem_input:
             with st.spinner("Creating solution template..."):
-                # Map selections
-                template_map = {
-                    "Auto-detect": "auto",
-                    "SWOT Analysis": "swot",
-                    "Budget Outline": "budget",
-                    "Action Plan": "action_plan",
-                    "Stakeholder Analysis": "stakeholder",
-                    "Project Timeline": "timeline"
-                }
-                
                 result = st.session_state.mentor.solution_mode(
                     problem_input,
-                    template_map[template_type],
+                    _TEMPLATE_MAP[template_type],
                     None
                 )
                 
@@ -390,28 +431,28 @@ def display_solution_mode():
                             st.markdown(f"- {tip}")
                     
                     # Download button
-                    download_content = f"""# {result.get('template_type', '').replace('_', ' ').title()} Template
+                    parts = [f"""# {result.get('template_type', '').replace('_', ' ').title()} Template
 
 Problem: {problem_input}
 
 ## Template
 
-"""
+"""]
                     for section, items in template_data.items():
-                        download_content += f"\n### {section}\n"
+                        parts.append(f"\n### {section}\n")
                         if isinstance(items, list):
-                            for item in items:
-                                download_content += f"- {item}\n"
+                            parts.extend(f"- {item}\n" for item in items)
                         else:
-                            download_content += f"{items}\n"
+                            parts.append(f"{items}\n")
                     
                     if result.get('implementation_guide'):
-                        download_content += f"\n## Implementation Guide\n{result['implementation_guide']}\n"
+                        parts.append(f"\n## Implementation Guide\n{result['implementation_guide']}\n")
                     
                     if result.get('tips'):
-                        download_content += "\n## Tips\n"
-                        for tip in result['tips']:
-                            download_content += f"- {tip}\n"
+                        parts.append("\n## Tips\n")
+                        parts.extend(f"- {tip}\n" for tip in result['tips'])
+                    
+                    download_content = "".join(parts)
                     
                     st.download_button(
                         label="Download Template",
@@ -425,8 +466,9 @@ Problem: {problem_input}
             st.warning("Please describe a problem first.")
 
 
+@st.fragment
 def display_interactive_chat():
-    """Display interactive chat interface"""
+    """Display interactive chat interface; its widgets rerun only this fragment"""
     st.markdown("#### Interactive Mentor Chat")
     st.info("Have a conversation with the AI mentor. Choose your preferred guidance style.")
     
@@ -441,11 +483,8 @@ def display_interactive_chat():
     if st.session_state.mentor_conversation:
         st.markdown("##### Conversation")
         for msg in st.session_state.mentor_conversation:
-            if msg['role'] == 'user':
-                st.markdown(f"**You:** {msg['content']}")
-            else:
-                st.markdown(f"**Mentor:** {msg['content']}")
-            st.markdown("---")
+            with st.chat_message("user" if msg['role'] == 'user' else "assistant"):
+                st.markdown(msg['content'])
     
     # Chat input
     user_message = st.text_area(
@@ -474,7 +513,7 @@ def display_interactive_chat():
                             'role': 'mentor',
                             'content': result['mentor_response']
                         })
-                        st.rerun()
+                        st.rerun(scope="fragment")
                     else:
                         st.error(f"Error: {result.get('error')}")
             else:
@@ -485,11 +524,14 @@ def display_interactive_chat():
             st.session_state.mentor_conversation = []
             if st.session_state.mentor:
                 st.session_state.mentor.reset_conversation()
-            st.rerun()
+            st.rerun(scope="fragment")
 
 
 def main():
     """Main application"""
+    # Custom CSS
+    st.markdown(_CSS, unsafe_allow_html=True)
+    
     # Display header
     display_header()
     
@@ -528,20 +570,23 @@ def main():
             
             uploaded_file = st.file_uploader(
                 "Choose an image...",
-                type=['png', 'jpg', 'jpeg', 'gif', 'webp'],
+                type=sorted(Config.ALLOWED_EXTENSIONS),
                 help="Supported formats: PNG, JPG, JPEG, GIF, WEBP"
             )
             
             col1, col2 = st.columns([2, 1])
             
+            upload_error = validate_upload(uploaded_file) if uploaded_file is not None else None
+            if upload_error:
+                st.error(upload_error)
+            
             with col1:
-                if uploaded_file is not None:
-                    # Display uploaded image
-                    image = Image.open(uploaded_file)
-                    st.image(image, caption="Uploaded Image", use_container_width=True)
+                if uploaded_file is not None and not upload_error:
+                    # Display uploaded image; the browser decodes the encoded bytes
+                    st.image(uploaded_file.getvalue(), caption="Uploaded Image", use_container_width=True)
             
             # Analyze button
-            if uploaded_file is not None:
+            if uploaded_file is not None and not upload_error:
                 if st.button("Analyze Image", key="analyze_image"):
                     domains = st.session_state.get('selected_domains', Config.CATEGORIES)
                     result = process_image(uploaded_file, domains)
@@ -0,0 +1,336 @@
+import hashlib
+import json
+import math
+import operator
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import google.generativeai as genai
+
+from config import Config
+from gemini_client import embed, embed_async, generate, generate_async
+
+
+def make_cache_key(**fields: Any) -> str:
+    """Build a stable SHA-256 key from canonicalized request fields"""
+    payload = json.dumps(fields, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def dedupe_texts(texts: List[str]) -> Tuple[List[str], List[int]]:
+    """Collapse texts that differ only in case or whitespace.
+    
+    Returns (unique, index) such that unique[index[i]] stands in for texts[i].
+    """
+    positions = {}
+    unique, index = [], []
+    for text in texts:
+        key = ' '.join(text.split()).lower()
+        if key not in positions:
+            positions[key] = len(unique)
+            unique.append(text)
+        index.append(positions[key])
+    return unique, index
+
+
+def fan_out(results: List[Dict], index: List[int], texts: List[str], key: str) -> List[Dict]:
+    """Map results for dedupe_texts' unique texts back onto every input, in order.
+    
+    Each result is copied with key set to its own input text.
+    """
+    return [{**results[i], key: text} for i, text in zip(index, texts)]
+
+
+class ResponseCache:
+    """Thread-safe in-memory LRU cache for LLM responses with per-entry TTL"""
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskCache:
+    """SQLite-backed string cache that survives restarts, with TTL and LRU eviction.
+    
+    The database is opened on first use. A path of None disables the cache:
+    get always misses and set does nothing.
+    """
+    
+    def __init__(self, path: Optional[str], maxsize: int = 10000,
+                 ttl: Optional[float] = None):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._conn = None
+        self._lock = threading.Lock()
+    
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                'expires_at REAL, accessed_at REAL NOT NULL)'
+            )
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)'
+            )
+            self._conn = conn
+        return self._conn
+    
+    def get(self, key: str) -> Optional[str]:
+        if self.path is None:
+            return None
+        
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                'SELECT value, expires_at FROM responses WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            
+            value, expires_at = row
+            with conn:
+                if expires_at is not None and expires_at < now:
+                    conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                    return None
+                conn.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+            return value
+    
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        if self.path is None:
+            return
+        
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                    (key, value, now + ttl if ttl else None, now)
+                )
+                # Evict least recently used entries beyond maxsize
+                conn.execute(
+                    'DELETE FROM responses WHERE key IN ('
+                    'SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+                    (self.maxsize,)
+                )
+    
+    def clear(self):
+        if self.path is None:
+            return
+        
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute('DELETE FROM responses')
+
+
+class SemanticCache:
+    """Returns a cached value when a new embedding is close enough to a stored one.
+
+    Entries are partitioned by namespace so that, e.g., a SWOT response is
+    never served for an action-plan request on a similar problem.
+    """
+
+    def __init__(self, threshold: float = 0.92, maxsize: int = 512):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self._stores = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> List[float]:
+        norm = math.sqrt(sum(x * x for x in embedding))
+        return [x / norm for x in embedding] if norm else list(embedding)
+
+    def lookup(self, namespace: Hashable, embedding: List[float]) -> Optional[Any]:
+        """Return the value of the most similar entry if it meets the threshold"""
+        query = self._normalize(embedding)
+
+        with self._lock:
+            entries = list(self._stores.get(namespace, ()))
+
+        best_value, best_sim = None, self.threshold
+        for vector, value in entries:
+            sim = sum(map(operator.mul, query, vector))
+            if sim >= best_sim:
+                best_value, best_sim = value, sim
+
+        return best_value
+
+    def add(self, namespace: Hashable, embedding: List[float], value: Any):
+        with self._lock:
+            store = self._stores.setdefault(namespace, deque(maxlen=self.maxsize))
+            store.append((self._normalize(embedding), value))
+
+    def clear(self):
+        with self._lock:
+            self._stores.clear()
+
+
+def embed_text(text: str) -> Optional[List[float]]:
+    """Embed text for semantic cache lookups; None if disabled or unavailable"""
+    if not Config.SEMANTIC_CACHE_ENABLED:
+        return None
+    
+    try:
+        result = embed(
+            model=Config.EMBED_MODEL,
+            content=text,
+            task_type='semantic_similarity'
+        )
+        return result['embedding']
+    except Exception:
+        # The cache is an optimization; never fail the request over it
+        return None
+
+
+async def embed_text_async(text: str) -> Optional[List[float]]:
+    """Async variant of embed_text"""
+    if not Config.SEMANTIC_CACHE_ENABLED:
+        return None
+    
+    try:
+        result = await embed_async(
+            model=Config.EMBED_MODEL,
+            content=text,
+            task_type='semantic_similarity'
+        )
+        return result['embedding']
+    except Exception:
+        return None
+
+
+class CachedGenerator:
+    """Gemini text generation behind an exact-prompt cache and a semantic cache.
+    
+    A prompt is looked up by hash first; with a problem_description, a
+    near-duplicate problem in the same namespace can also reuse a response
+    through the semantic cache. Only fresh responses reach the model.
+    """
+    
+    def __init__(self, model: genai.GenerativeModel, model_name: str,
+                 cache: DiskCache, semantic_cache: SemanticCache):
+        self.model = model
+        self.model_name = model_name
+        self.cache = cache
+        self.semantic_cache = semantic_cache
+    
+    def generate(self, prompt: str, decode: Callable[[str], Any], generation_config=None,
+                 problem_description: Optional[str] = None,
+                 namespace: Hashable = ()) -> Tuple[Any, str]:
+        """(decode(text), text) for a prompt, served from the caches when possible.
+        
+        decode raises ValueError for an unusable reply (e.g. truncated JSON).
+        Such a reply is never cached, and a cached one is treated as a miss.
+        """
+        cache_key = make_cache_key(model=self.model_name, prompt=prompt)
+        hit = self._decoded(self.cache.get(cache_key), decode)
+        if hit is not None:
+            return hit
+        
+        embedding = embed_text(problem_description) if problem_description else None
+        if embedding is not None:
+            hit = self._decoded(self.semantic_cache.lookup(namespace, embedding), decode)
+            if hit is not None:
+                # Repeats of this exact prompt then skip the embedding call
+                self.cache.set(cache_key, hit[1])
+                return hit
+        
+        result = generate(self.model, prompt, generation_config=generation_config).text
+        decoded = decode(result)
+        self._store(cache_key, namespace, embedding, result)
+        return decoded, result
+    
+    async def generate_async(self, prompt: str, decode: Callable[[str], Any],
+                             generation_config=None,
+                             problem_description: Optional[str] = None,
+                             namespace: Hashable = ()) -> Tuple[Any, str]:
+        """Async variant of generate"""
+        cache_key = make_cache_key(model=self.model_name, prompt=prompt)
+        hit = self._decoded(self.cache.get(cache_key), decode)
+        if hit is not None:
+            return hit
+        
+        embedding = await embed_text_async(problem_description) if problem_description else None
+        if embedding is not None:
+            hit = self._decoded(self.semantic_cache.lookup(namespace, embedding), decode)
+            if hit is not None:
+                # Repeats of this exact prompt then skip the embedding call
+                self.cache.set(cache_key, hit[1])
+                return hit
+        
+        result = (await generate_async(
+            self.model, prompt, generation_config=generation_config
+        )).text
+        decoded = decode(result)
+        self._store(cache_key, namespace, embedding, result)
+        return decoded, result
+    
+    @staticmethod
+    def _decoded(cached: Optional[str],
+                 decode: Callable[[str], Any]) -> Optional[Tuple[Any, str]]:
+        """(decode(cached), cached), or None on a miss or an undecodable entry"""
+        if cached is None:
+            return None
+        try:
+            return decode(cached), cached
+        except ValueError:
+            return None
+    
+    def _store(self, cache_key: str, namespace: Hashable,
+               embedding: Optional[List[float]], result: str):
+        self.cache.set(cache_key, result)
+        if embedding is not None:
+            self.semantic_cache.add(namespace, embedding, result)
+
+
+# One on-disk store for the Gemini clients that cache by prompt hash
+disk_cache = DiskCache(
+    os.path.join(Config.CACHE_DIR, 'responses.sqlite3') if Config.DISK_CACHE_ENABLED else None,
+    maxsize=Config.DISK_CACHE_MAX_ENTRIES,
+    ttl=Config.DISK_CACHE_TTL
+)
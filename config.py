@@ -9,10 +9,54 @@ class Config:
     
     # Google Gemini API Configuration
     GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+    GEMINI_TRANSPORT = os.getenv('GEMINI_TRANSPORT')  # optional: 'grpc' or 'rest'
+    GEMINI_API_ENDPOINT = os.getenv('GEMINI_API_ENDPOINT')  # optional override
     
     # Model configurations
     VISION_MODEL = "gemini-2.5-flash"  # Gemini Vision model
     TEXT_MODEL = "gemini-2.5-flash"  # For NLP tasks
+    FAST_MODEL = "gemini-2.5-flash-lite"  # Cheaper model for simple requests
+    
+    # Requests shorter than this using one of these templates go to FAST_MODEL
+    FAST_MODEL_MAX_CHARS = 400
+    FAST_MODEL_TEMPLATES = {'action_plan', 'timeline'}
+    
+    # Response cache settings
+    CACHE_TTL = int(os.getenv('CACHE_TTL', 3600))  # seconds
+    CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 1024))
+    # Persistent response cache shared by the detector, classifier and mission generator
+    DISK_CACHE_ENABLED = os.getenv('DISK_CACHE_ENABLED', 'true').lower() == 'true'
+    CACHE_DIR = os.getenv('CACHE_DIR', '.cache')
+    DISK_CACHE_TTL = int(os.getenv('DISK_CACHE_TTL', 7 * 24 * 3600))  # seconds
+    DISK_CACHE_MAX_ENTRIES = int(os.getenv('DISK_CACHE_MAX_ENTRIES', 10000))
+    
+    # Gemini rate limiting and retries (GEMINI_RPM=0 disables client-side limiting)
+    GEMINI_RPM = int(os.getenv('GEMINI_RPM', 0))
+    RETRY_TIMEOUT = float(os.getenv('RETRY_TIMEOUT', 120))  # total seconds across retries
+    
+    # Concurrency limit for async batch calls (respect Gemini RPM)
+    MAX_CONCURRENT = int(os.getenv('MAX_CONCURRENT', 8))
+    # Analyze uploads and descriptions with one structured Gemini call instead of
+    # the step-by-step (detect ->) classify -> mission pipeline
+    SINGLE_SHOT_ANALYSIS = os.getenv('SINGLE_SHOT_ANALYSIS', 'false').lower() == 'true'
+    # Worker threads for blocking multi-image pipelines and the sync batch methods, which
+    # are then safe to call from inside a running event loop; sized to concurrent Gemini calls, not CPUs
+    THREAD_POOL_SIZE = int(os.getenv('THREAD_POOL_SIZE', MAX_CONCURRENT))
+    
+    # Max problems per batched prompt (larger batches let decode latency dominate)
+    BATCH_PROMPT_SIZE = int(os.getenv('BATCH_PROMPT_SIZE', 8))
+    # Problems are binned by length in steps of this many characters before batching
+    BATCH_LENGTH_BUCKET = 512
+    # Seconds between status checks of an offline Batch API job
+    BATCH_POLL_INTERVAL = int(os.getenv('BATCH_POLL_INTERVAL', 30))
+    
+    # Mentor chat history kept in memory per AIMentor (older turns are dropped)
+    MAX_HISTORY = int(os.getenv('MAX_HISTORY', 32))
+    
+    # Semantic cache settings (near-duplicate problem descriptions)
+    EMBED_MODEL = "models/text-embedding-004"
+    SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', 'true').lower() == 'true'
+    SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.92))
     
     # Problem categories
     CATEGORIES = ['Environment', 'Health', 'Education']
@@ -48,6 +92,13 @@ class Config:
     # Image upload settings
     MAX_IMAGE_SIZE = 20 * 1024 * 1024  # 20MB
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+    # Upper bound on decoded pixels, so a small compressed file cannot exhaust memory
+    MAX_IMAGE_PIXELS = 50_000_000
+    # Larger uploads are downscaled to fit this box (2x2 Gemini tiles) and sent as WebP
+    VISION_MAX_DIMENSION = 1536
+    VISION_WEBP_QUALITY = 85
+    # Files smaller than this are sent as-is without even reading the image header
+    VISION_DOWNSCALE_MIN_BYTES = 200 * 1024
     
     @staticmethod
     def validate():
@@ -0,0 +1,84 @@
+from functools import lru_cache
+from typing import Any, Optional
+import google.generativeai as genai
+from google.api_core import retry, retry_async
+from config import Config
+from rate_limiter import gemini_rate_limiter
+
+
+# Exponential backoff with jitter on 429 (ResourceExhausted) and 5xx errors
+_RETRY_SETTINGS = {
+    'predicate': retry.if_transient_error,
+    'initial': 1.0,
+    'multiplier': 2.0,
+    'maximum': 30.0,
+    'timeout': Config.RETRY_TIMEOUT
+}
+_RETRY = retry.Retry(**_RETRY_SETTINGS)
+_ASYNC_RETRY = retry_async.AsyncRetry(**_RETRY_SETTINGS)
+
+# API key genai was last configured with; genai.configure is global state.
+# Starts unset rather than None, so configure(None) (key from the environment
+# or ADC) still applies the transport and endpoint options on first use.
+_UNSET = object()
+_CONFIGURED_KEY: Any = _UNSET
+
+
+def configure(api_key: Optional[str]):
+    """Configure the Gemini SDK once per API key rather than on every client.
+    
+    The SDK keeps one client (and its HTTP/2 gRPC channel) per configuration,
+    so configuring once lets every model reuse the same connection. The
+    transport is only passed when set, since async clients need grpc_asyncio
+    rather than the sync default.
+    """
+    global _CONFIGURED_KEY
+    if _CONFIGURED_KEY != api_key:
+        options = {}
+        if Config.GEMINI_TRANSPORT:
+            options['transport'] = Config.GEMINI_TRANSPORT
+        if Config.GEMINI_API_ENDPOINT:
+            options['client_options'] = {'api_endpoint': Config.GEMINI_API_ENDPOINT}
+        genai.configure(api_key=api_key, **options)
+        _CONFIGURED_KEY = api_key
+
+
+@lru_cache(maxsize=8)
+def get_model(api_key: Optional[str], model_name: str) -> genai.GenerativeModel:
+    """Shared GenerativeModel per (api_key, model_name).
+    
+    Building a detector, classifier or mission generator then costs a dict
+    lookup instead of SDK configuration plus a new model object.
+    """
+    configure(api_key)
+    return genai.GenerativeModel(model_name)
+
+
+def generate(model: genai.GenerativeModel, contents, **kwargs):
+    """generate_content under the shared rate limit, retrying transient errors (429/5xx).
+    
+    Every client goes through here, so concurrent batches across the process
+    stay within Config.GEMINI_RPM instead of tripping 429s and backing off.
+    """
+    gemini_rate_limiter.acquire()
+    return model.generate_content(contents, request_options={'retry': _RETRY}, **kwargs)
+
+
+async def generate_async(model: genai.GenerativeModel, contents, **kwargs):
+    """Async variant of generate"""
+    await gemini_rate_limiter.acquire_async()
+    return await model.generate_content_async(
+        contents, request_options={'retry': _ASYNC_RETRY}, **kwargs
+    )
+
+
+def embed(**kwargs):
+    """genai.embed_content under the same rate limit and retry policy as generate"""
+    gemini_rate_limiter.acquire()
+    return genai.embed_content(request_options={'retry': _RETRY}, **kwargs)
+
+
+async def embed_async(**kwargs):
+    """Async variant of embed"""
+    await gemini_rate_limiter.acquire_async()
+    return await genai.embed_content_async(request_options={'retry': _ASYNC_RETRY}, **kwargs)
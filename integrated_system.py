@@ -1,8 +1,84 @@
-from typing import Dict, Optional, List
-from vision_detector import CommunityIssueDetector
-from mission_generator import MissionStatementGenerator
-from problem_classifier import ProblemClassifier
+import asyncio
+import hashlib
+import json
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional, List, Tuple
+import google.generativeai as genai
+from cache import ResponseCache, make_cache_key
+from vision_detector import CommunityIssueDetector, guess_mime_type
+from mission_generator import MISSION_SCHEMA, MissionStatementGenerator
+from problem_classifier import CLASSIFICATION_SCHEMA, ProblemClassifier, normalize_confidence
 from config import Config
+from gemini_client import generate, get_model
+
+# Section headers the vision prompt asks for, found in one pass over the analysis
+_SECTION_RE = re.compile(r'(DETECTED ISSUES|VISUAL EVIDENCE|RECOMMENDATIONS):')
+
+# Summary banner rules
+_BAR = '=' * 70
+_SUBBAR = '-' * 70
+
+# URLs and file names with an allowed image extension are treated as images
+_IMAGE_SOURCE_RE = re.compile(
+    r'^https?://|\.(?:%s)$' % '|'.join(map(re.escape, sorted(Config.ALLOWED_EXTENSIONS))),
+    re.IGNORECASE
+)
+
+
+# Single-shot analysis: detection, classification and mission in one structured response
+_CLASSIFICATION_INSTRUCTIONS = (
+    f"(exactly one of: {', '.join(Config.CATEGORIES)}), "
+    "your confidence (High, Medium or Low) and your reasoning"
+)
+
+_MISSION_INSTRUCTIONS = """a formalized, project-oriented mission for a learning project that addresses the primary issue, with
+  mission_statement (2-3 inspiring sentences defining the problem, the goal and the community impact),
+  problem_definition (1-2 sentences), goal (specific and measurable), expected_impact and 3-5 action_steps"""
+
+_SINGLE_SHOT_INSTRUCTIONS = f"""
+
+Respond with one JSON object instead of plain text:
+- vision_analysis: the full report above, keeping the DETECTED ISSUES, VISUAL EVIDENCE and RECOMMENDATIONS headers
+- classification: the primary category of the detected issues {_CLASSIFICATION_INSTRUCTIONS}
+- mission_statement: {_MISSION_INSTRUCTIONS}"""
+
+# Text single-shot: classification and mission for a description in one call.
+# The static instructions come first so Gemini's prefix cache can reuse them.
+_TEXT_SINGLE_SHOT_PREFIX = sys.intern(f"""You are an expert at turning community problems into learning projects.
+You classify problems accurately and write clear, motivating mission statements.
+
+For the community problem description at the end of this prompt, respond with one JSON object:
+- classification: the primary category {_CLASSIFICATION_INSTRUCTIONS}. Choose only ONE category, even if the problem touches multiple areas
+- mission_statement: {_MISSION_INSTRUCTIONS}
+""")
+
+_SINGLE_SHOT_CONFIG = genai.GenerationConfig(
+    response_mime_type='application/json',
+    response_schema={
+        'type': 'OBJECT',
+        'properties': {
+            'vision_analysis': {'type': 'STRING'},
+            'classification': CLASSIFICATION_SCHEMA,
+            'mission_statement': MISSION_SCHEMA
+        },
+        'required': ['vision_analysis', 'classification', 'mission_statement']
+    }
+)
+
+_TEXT_SINGLE_SHOT_CONFIG = genai.GenerationConfig(
+    response_mime_type='application/json',
+    response_schema={
+        'type': 'OBJECT',
+        'properties': {
+            'classification': CLASSIFICATION_SCHEMA,
+            'mission_statement': MISSION_SCHEMA
+        },
+        'required': ['classification', 'mission_statement']
+    }
+)
 
 
 class AILearningPlatform:
@@ -13,14 +89,128 @@ class AILearningPlatform:
         self.vision_detector = CommunityIssueDetector(api_key)
         self.mission_generator = MissionStatementGenerator(api_key)
         self.problem_classifier = ProblemClassifier(api_key)
+        # Text model for single-shot description analysis
+        self.text_model = get_model(api_key or Config.GEMINI_API_KEY, Config.TEXT_MODEL)
+        # Full analyses keyed on input content, so re-submitting the same image is free
+        self.cache = ResponseCache(maxsize=Config.CACHE_MAX_ENTRIES, ttl=Config.CACHE_TTL)
     
     def process_image(self, image_path: str, 
                      domains: Optional[List[str]] = None) -> Dict:
+        try:
+            with open(image_path, 'rb') as f:
+                image_bytes = f.read()
+        except OSError:
+            # Let the detector report the unreadable file
+            return self._process_vision_result(
+                self.vision_detector.detect_issues(image_path, domains)
+            )
+        
+        # Reuse the bytes already read for hashing as the detector input
+        result = self.process_image_bytes(
+            image_bytes, guess_mime_type(image_bytes, image_path), domains
+        )
+        if result['success']:
+            result = {**result, 'image_path': image_path}
+        return result
+    
+    def process_image_bytes(self, image_bytes: bytes, mime_type: str,
+                            domains: Optional[List[str]] = None,
+                            on_text: Optional[Callable[[str], Any]] = None) -> Dict:
+        """Same as process_image for an in-memory encoded image (e.g. an upload).
+        
+        on_text, if given, receives the vision analysis as it streams in.
+        """
+        return self._cached(
+            self._image_cache_key(image_bytes, domains),
+            lambda: self._process_image_bytes(image_bytes, mime_type, domains, on_text)
+        )
+    
+    def _process_image_bytes(self, image_bytes: bytes, mime_type: str,
+                             domains: Optional[List[str]],
+                             on_text: Optional[Callable[[str], Any]] = None) -> Dict:
         print("Analyzing image for community issues...")
         
         # Step 1: Detect issues in the image
-        vision_result = self.vision_detector.detect_issues(image_path, domains)
+        vision_result = self.vision_detector.detect_issues_from_bytes(
+            image_bytes, mime_type, domains, on_text
+        )
+        
+        return self._process_vision_result(vision_result)
+    
+    def process_image_single_shot(self, image_bytes: bytes, mime_type: str,
+                                  domains: Optional[List[str]] = None) -> Dict:
+        """Analyze an image with one Gemini call; falls back to the three-step pipeline.
         
+        Shares process_image_bytes' cache entries, since both produce the same result shape.
+        """
+        return self._cached(
+            self._image_cache_key(image_bytes, domains),
+            lambda: self._process_image_single_shot(image_bytes, mime_type, domains)
+        )
+    
+    def _process_image_single_shot(self, image_bytes: bytes, mime_type: str,
+                                   domains: Optional[List[str]]) -> Dict:
+        print("Analyzing image in a single request...")
+        
+        try:
+            response = self.vision_detector.generate_from_bytes(
+                image_bytes, mime_type, _SINGLE_SHOT_INSTRUCTIONS, _SINGLE_SHOT_CONFIG, domains
+            )
+            return self._single_shot_result(json.loads(response), response)
+            
+        except Exception as e:
+            print(f"Single-shot analysis failed ({e}); using the step-by-step pipeline")
+            return self._process_image_bytes(image_bytes, mime_type, domains)
+    
+    def _single_shot_result(self, parsed: Dict, full_response: str) -> Dict:
+        """Map a single-shot response onto the process_image result; raises if it is unusable"""
+        vision_analysis = parsed['vision_analysis']
+        if not vision_analysis.strip():
+            raise ValueError("empty analysis")
+        
+        classification, mission = self._single_shot_parts(
+            parsed, full_response, self._extract_problem_description(vision_analysis)
+        )
+        classification['source'] = 'vision_analysis'
+        
+        return {
+            'success': True,
+            'vision_analysis': vision_analysis,
+            'classification': classification,
+            'mission_statement': mission,
+            'summary': self._create_summary({'analysis': vision_analysis}, classification, mission)
+        }
+    
+    def _single_shot_parts(self, parsed: Dict, full_response: str,
+                           original_description: str) -> Tuple[Dict, Dict]:
+        """Split the classification and mission out of a single-shot response"""
+        category = parsed['classification']['category'].strip().title()
+        mission_fields = parsed['mission_statement']
+        
+        if not mission_fields['mission_statement'].strip():
+            raise ValueError("empty mission statement")
+        if category not in Config.CATEGORIES:
+            raise ValueError(f"unknown category {category!r}")
+        
+        classification = {
+            'success': True,
+            'category': category,
+            'confidence': normalize_confidence(parsed['classification']['confidence']),
+            'reasoning': parsed['classification']['reasoning']
+        }
+        mission = {
+            'success': True,
+            'original_description': original_description,
+            'mission_statement': mission_fields['mission_statement'],
+            'problem_definition': mission_fields['problem_definition'],
+            'goal': mission_fields['goal'],
+            'expected_impact': mission_fields['expected_impact'],
+            'action_steps': mission_fields['action_steps'],
+            'full_response': full_response
+        }
+        return classification, mission
+    
+    def _process_vision_result(self, vision_result: Dict) -> Dict:
         if not vision_result['success']:
             return {
                 'success': False,
@@ -32,9 +222,7 @@ class AILearningPlatform:
         print("\nClassifying the detected problems...")
         
         # Step 2: Classify the detected issues
-        classification = self.problem_classifier.classify_with_vision_analysis(
-            vision_result['analysis']
-        )
+        classification = self._classify_vision_analysis(vision_result['analysis'])
         
         print(f"Classified as: {classification.get('category', 'Unknown')}")
         
@@ -44,16 +232,15 @@ class AILearningPlatform:
         print("\nGenerating mission statement...")
         
         # Step 4: Generate mission statement
-        mission = self.mission_generator.generate_mission_statement(
+        mission = self._generate_mission(
             problem_desc,
-            context=f"Based on visual analysis. Category: {classification.get('category')}"
+            f"Based on visual analysis. Category: {classification.get('category')}"
         )
 
         print("Mission statement generated")
 
         return {
             'success': True,
-            'image_path': image_path,
             'vision_analysis': vision_result['analysis'],
             'classification': classification,
             'mission_statement': mission,
@@ -61,6 +248,53 @@ class AILearningPlatform:
         }
     
     def process_text_description(self, problem_description: str) -> Dict:
+        return self._cached(
+            self._text_cache_key(problem_description),
+            lambda: self._process_text_description(problem_description)
+        )
+    
+    def process_text_single_shot(self, problem_description: str) -> Dict:
+        """Classify a description and write its mission in one Gemini call.
+        
+        Falls back to the two-step pipeline, and shares process_text_description's
+        cache entries since both produce the same result shape.
+        """
+        return self._cached(
+            self._text_cache_key(problem_description),
+            lambda: self._process_text_single_shot(problem_description)
+        )
+    
+    def _process_text_single_shot(self, problem_description: str) -> Dict:
+        print("Processing problem description in a single request...")
+        
+        prompt = ''.join([
+            _TEXT_SINGLE_SHOT_PREFIX, '\nProblem Description: "', problem_description, '"\n'
+        ])
+        try:
+            response = generate(
+                self.text_model, prompt, generation_config=_TEXT_SINGLE_SHOT_CONFIG
+            ).text
+            classification, mission = self._single_shot_parts(
+                json.loads(response), response, problem_description
+            )
+            
+        except Exception as e:
+            print(f"Single-shot analysis failed ({e}); using the step-by-step pipeline")
+            return self._process_text_description(problem_description)
+        
+        classification.update({
+            'problem_description': problem_description,
+            'all_categories': Config.CATEGORIES
+        })
+        return {
+            'success': True,
+            'original_description': problem_description,
+            'classification': classification,
+            'mission_statement': mission,
+            'summary': self._create_text_summary(problem_description, classification, mission)
+        }
+    
+    def _process_text_description(self, problem_description: str) -> Dict:
         print("Processing problem description...")
         
         # Step 1: Classify the problem
@@ -77,9 +311,9 @@ class AILearningPlatform:
         print("\nGenerating mission statement...")
         
         # Step 2: Generate mission statement
-        mission = self.mission_generator.generate_mission_statement(
+        mission = self._generate_mission(
             problem_description,
-            context=f"Category: {classification['category']}"
+            f"Category: {classification['category']}"
         )
         
         if not mission['success']:
@@ -100,32 +334,118 @@ class AILearningPlatform:
             'summary': self._create_text_summary(problem_description, classification, mission)
         }
     
+    async def aprocess_image(self, image_path: str,
+                             domains: Optional[List[str]] = None) -> Dict:
+        """Run process_image in a worker thread so async callers stay non-blocking"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, partial(self.process_image, image_path, domains)
+        )
+    
+    async def aprocess_text_description(self, problem_description: str) -> Dict:
+        """Run process_text_description in a worker thread so async callers stay non-blocking"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, self.process_text_description, problem_description
+        )
+    
+    async def aprocess_multiple_images(self, image_paths: List[str],
+                                       domains: Optional[List[str]] = None) -> List[Dict]:
+        """Analyze images concurrently, at most Config.MAX_CONCURRENT at a time, in input order"""
+        semaphore = asyncio.Semaphore(Config.MAX_CONCURRENT)
+        
+        async def process_one(image_path: str) -> Dict:
+            async with semaphore:
+                return await self.aprocess_image(image_path, domains)
+        
+        return await asyncio.gather(*(process_one(path) for path in image_paths))
+    
     def process_multiple_images(self, image_paths: List[str]) -> List[Dict]:
-        results = []
-        for i, image_path in enumerate(image_paths, 1):
-            print(f"\n{'='*60}")
-            print(f"Processing Image {i}/{len(image_paths)}")
-            print(f"{'='*60}")
-            
-            result = self.process_image(image_path)
-            results.append(result)
+        print(f"\n{'='*60}")
+        print(f"Processing {len(image_paths)} images ({Config.THREAD_POOL_SIZE} workers)")
+        print(f"{'='*60}")
+        
+        # Each image is three network-bound Gemini calls, so overlap images on threads
+        with ThreadPoolExecutor(max_workers=Config.THREAD_POOL_SIZE) as executor:
+            return list(executor.map(self.process_image, image_paths))
+    
+    def _classify_vision_analysis(self, vision_analysis: str) -> Dict:
+        """Classify an analysis, reusing the result when the same analysis text comes back"""
+        cache_key = make_cache_key(
+            step='classify_vision',
+            analysis=vision_analysis,
+            text_model=Config.TEXT_MODEL
+        )
+        return self._cached(
+            cache_key,
+            lambda: self.problem_classifier.classify_with_vision_analysis(vision_analysis)
+        )
+    
+    def _generate_mission(self, problem_description: str, context: str) -> Dict:
+        """Generate a mission statement, reusing the result for a repeated (problem, context)"""
+        cache_key = make_cache_key(
+            step='mission',
+            problem=problem_description,
+            context=context,
+            text_model=Config.TEXT_MODEL
+        )
+        return self._cached(
+            cache_key,
+            lambda: self.mission_generator.generate_mission_statement(
+                problem_description, context=context
+            )
+        )
+    
+    def _text_cache_key(self, problem_description: str) -> str:
+        """Key a text analysis on the whitespace-normalized description and the text model"""
+        return make_cache_key(
+            description=' '.join(problem_description.split()),
+            text_model=Config.TEXT_MODEL
+        )
+    
+    def _image_cache_key(self, image_bytes: bytes, domains: Optional[List[str]]) -> str:
+        """Key an image analysis on content, domains and models so either change invalidates it"""
+        return make_cache_key(
+            image=hashlib.sha256(image_bytes).hexdigest(),
+            domains=sorted(domains or Config.CATEGORIES),
+            vision_model=Config.VISION_MODEL,
+            text_model=Config.TEXT_MODEL
+        )
+    
+    def _cached(self, cache_key: Optional[str], compute: Callable[[], Dict]) -> Dict:
+        """Return a cached analysis or compute one; only successful results are stored"""
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return {**cached, 'from_cache': True}
         
-        return results
+        result = compute()
+        if result['success']:
+            result['from_cache'] = False
+            if cache_key is not None:
+                self.cache.set(cache_key, result)
+        return result
     
     def _extract_problem_description(self, vision_analysis: str) -> str:
-        # Look for detected issues section
-        if "DETECTED ISSUES:" in vision_analysis:
-            start = vision_analysis.find("DETECTED ISSUES:")
-            end = vision_analysis.find("VISUAL EVIDENCE:", start)
-            if end == -1:
-                end = vision_analysis.find("RECOMMENDATIONS:", start)
-            if end == -1:
-                end = len(vision_analysis)
-            
-            issues_section = vision_analysis[start:end].strip()
+        # Locate the detected issues section and the first header that ends it
+        start = None
+        next_sections = {}
+        for match in _SECTION_RE.finditer(vision_analysis):
+            label = match.group(1)
+            if start is None:
+                if label == 'DETECTED ISSUES':
+                    start = match.start()
+            elif label != 'DETECTED ISSUES':
+                next_sections.setdefault(label, match.start())
+                if label == 'VISUAL EVIDENCE':
+                    break
+        
+        if start is not None:
+            end = next_sections.get('VISUAL EVIDENCE', next_sections.get('RECOMMENDATIONS'))
+            issues_section = vision_analysis[start:end]
             # Take first few lines as description
-            lines = [line.strip() for line in issues_section.split('\n') 
-                    if line.strip() and not line.strip().startswith('DETECTED')]
+            lines = [line for line in map(str.strip, issues_section.split('\n'))
+                     if line and not line.startswith('DETECTED')]
             return ' '.join(lines[:3]) if lines else vision_analysis[:200]
         
         # Fallback: use first 200 characters
@@ -134,21 +454,21 @@ class AILearningPlatform:
     def _create_summary(self, vision_result: Dict, classification: Dict, 
                        mission: Dict) -> str:
         summary = f"""
-{'='*70}
+{_BAR}
                     COMMUNITY ISSUE ANALYSIS SUMMARY
-{'='*70}
+{_BAR}
 
 VISION ANALYSIS:
-{'-'*70}
+{_SUBBAR}
 {vision_result['analysis'][:500]}...
 
 CLASSIFICATION:
-{'-'*70}
+{_SUBBAR}
 Category: {classification.get('category', 'Unknown')}
 Confidence: {classification.get('confidence', 'Unknown')}
 
 MISSION STATEMENT:
-{'-'*70}
+{_SUBBAR}
 {mission.get('mission_statement', 'N/A')}
 
 PROBLEM DEFINITION:
@@ -157,41 +477,41 @@ PROBLEM DEFINITION:
 EXPECTED IMPACT:
 {mission.get('expected_impact', 'N/A')}
 
-{'='*70}
+{_BAR}
 """
         return summary
     
     def _create_text_summary(self, description: str, classification: Dict, 
                            mission: Dict) -> str:
         summary = f"""
-{'='*70}
+{_BAR}
                     PROBLEM ANALYSIS SUMMARY
-{'='*70}
+{_BAR}
 
 ORIGINAL DESCRIPTION:
-{'-'*70}
+{_SUBBAR}
 {description}
 
 CLASSIFICATION:
-{'-'*70}
+{_SUBBAR}
 Category: {classification.get('category', 'Unknown')}
 Confidence: {classification.get('confidence', 'Unknown')}
 Reasoning: {classification.get('reasoning', 'N/A')[:200]}
 
 MISSION STATEMENT:
-{'-'*70}
+{_SUBBAR}
 {mission.get('mission_statement', 'N/A')}
 
 EXPECTED IMPACT:
 {mission.get('expected_impact', 'N/A')}
 
 ACTION STEPS:
-{'-'*70}
+{_SUBBAR}
 """
         for i, step in enumerate(mission.get('action_steps', []), 1):
             summary += f"{i}. {step}\n"
         
-        summary += f"\n{'='*70}\n"
+        summary += f"\n{_BAR}\n"
         return summary
 
 
@@ -201,11 +521,7 @@ def analyze_community_issue(source: str, source_type: str = 'auto') -> Dict:
     
     # Auto-detect source type
     if source_type == 'auto':
-        if (source.startswith('http://') or source.startswith('https://') or 
-            source.endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp'))):
-            source_type = 'image'
-        else:
-            source_type = 'text'
+        source_type = 'image' if _IMAGE_SOURCE_RE.search(source) else 'text'
     
     if source_type == 'image':
         return platform.process_image(source)
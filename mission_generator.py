@@ -1,6 +1,88 @@
-from typing import Optional, Dict
+import asyncio
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional, Dict, List
 import google.generativeai as genai
+from cache import CachedGenerator, SemanticCache, dedupe_texts, disk_cache, fan_out
 from config import Config
+from gemini_client import get_model
+from parsers import parse_mission_response
+
+
+# Static instructions come first and are byte-identical across calls, so
+# Gemini's prefix cache can reuse them; the problem text goes at the end.
+_MISSION_STATIC_PREFIX = sys.intern("""You are an expert at converting community problems into actionable, 
+inspiring mission statements for learning projects. You create clear, motivating statements 
+that define the problem, the goal, and the expected impact.
+
+Convert the community problem description at the end of this prompt into a formalized, project-oriented mission statement.
+
+Please provide:
+
+- mission_statement: A clear, inspiring statement (2-3 sentences) that:
+   - Defines the core problem
+   - States the goal/objective
+   - Highlights the expected community impact
+
+- problem_definition: A precise definition of the issue (1-2 sentences)
+
+- goal: The specific, measurable outcome we're working toward
+
+- expected_impact: How this will benefit the community
+
+- action_steps: 3-5 key steps to address this problem
+""")
+
+
+# Gemini returns JSON matching this schema; parsers.parse_mission_response only
+# handles plain-text replies (e.g. from an endpoint without structured output)
+_MISSION_FIELDS = ['mission_statement', 'problem_definition', 'goal', 'expected_impact']
+
+# Also nested in integrated_system's single-shot schemas
+MISSION_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        **{field: {'type': 'STRING'} for field in _MISSION_FIELDS},
+        'action_steps': {'type': 'ARRAY', 'items': {'type': 'STRING'}}
+    },
+    'required': _MISSION_FIELDS + ['action_steps']
+}
+
+_MISSION_CONFIG = genai.GenerationConfig(
+    response_mime_type='application/json',
+    response_schema=MISSION_SCHEMA
+)
+
+
+def _decode_mission(response: str) -> Dict:
+    """Mission fields from a JSON reply, else via the header parser.
+    
+    Raises ValueError if the reply has no mission statement, e.g. JSON cut
+    off mid-string, so that it is never cached or shown as a success.
+    """
+    try:
+        parsed = json.loads(response)
+    except ValueError:
+        parsed = parse_mission_response(response)
+    else:
+        required = MISSION_SCHEMA['required']
+        if not isinstance(parsed, dict) or not all(key in parsed for key in required):
+            raise ValueError("Mission statement reply is missing required fields")
+    
+    if not str(parsed.get('mission_statement', '')).strip():
+        raise ValueError("Mission statement reply has no mission statement")
+    return parsed
+
+
+# Deterministic per (problem, context), so repeat calls reuse the built string
+@lru_cache(maxsize=1024)
+def _build_mission_prompt(problem_description: str, context: Optional[str]) -> str:
+    parts = [_MISSION_STATIC_PREFIX, '\nProblem Description: "', problem_description, '"\n']
+    if context:
+        parts += ['\nAdditional Context: ', context, '\n']
+    return ''.join(parts)
 
 
 class MissionStatementGenerator:
@@ -8,30 +90,40 @@ class MissionStatementGenerator:
     
     def __init__(self, api_key: Optional[str] = None):
         self.api_key = api_key or Config.GEMINI_API_KEY
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel(Config.TEXT_MODEL)
+        self.model = get_model(self.api_key, Config.TEXT_MODEL)
+        self.cache = disk_cache
+        self.semantic_cache = SemanticCache(threshold=Config.SEMANTIC_CACHE_THRESHOLD)
+        self.generator = CachedGenerator(
+            self.model, Config.TEXT_MODEL, self.cache, self.semantic_cache
+        )
     
     def generate_mission_statement(self, problem_description: str, 
                                    context: Optional[str] = None) -> Dict:
         prompt = self._create_mission_prompt(problem_description, context)
         
         try:
-            response = self.model.generate_content(prompt)
-            result = response.text
-            
-            # Parse the structured response
-            parsed = self._parse_mission_response(result)
+            parsed, result = self.generator.generate(
+                prompt, _decode_mission, _MISSION_CONFIG, problem_description, ('mission', context)
+            )
+            return self._mission_result(problem_description, parsed, result)
             
+        except Exception as e:
             return {
-                'success': True,
-                'original_description': problem_description,
-                'mission_statement': parsed.get('mission_statement', result),
-                'problem_definition': parsed.get('problem_definition', ''),
-                'goal': parsed.get('goal', ''),
-                'expected_impact': parsed.get('expected_impact', ''),
-                'action_steps': parsed.get('action_steps', []),
-                'full_response': result
+                'success': False,
+                'error': str(e),
+                'original_description': problem_description
             }
+    
+    async def generate_mission_statement_async(self, problem_description: str,
+                                               context: Optional[str] = None) -> Dict:
+        """Async variant of generate_mission_statement"""
+        prompt = self._create_mission_prompt(problem_description, context)
+        
+        try:
+            parsed, result = await self.generator.generate_async(
+                prompt, _decode_mission, _MISSION_CONFIG, problem_description, ('mission', context)
+            )
+            return self._mission_result(problem_description, parsed, result)
             
         except Exception as e:
             return {
@@ -40,87 +132,41 @@ class MissionStatementGenerator:
                 'original_description': problem_description
             }
     
+    def _mission_result(self, problem_description: str, parsed: Dict, result: str) -> Dict:
+        return {
+            'success': True,
+            'original_description': problem_description,
+            'mission_statement': parsed['mission_statement'],
+            'problem_definition': parsed.get('problem_definition', ''),
+            'goal': parsed.get('goal', ''),
+            'expected_impact': parsed.get('expected_impact', ''),
+            'action_steps': parsed.get('action_steps', []),
+            'full_response': result
+        }
+    
     def _create_mission_prompt(self, problem_description: str, 
                               context: Optional[str] = None) -> str:
-        base_prompt = f"""You are an expert at converting community problems into actionable, 
-inspiring mission statements for learning projects. You create clear, motivating statements 
-that define the problem, the goal, and the expected impact.
-
-Convert the following community problem description into a formalized, project-oriented mission statement:
-
-Problem Description: "{problem_description}"
-"""
-        
-        if context:
-            base_prompt += f"\nAdditional Context: {context}\n"
+        return _build_mission_prompt(problem_description, context)
+    
+    def generate_batch_missions(self, problem_descriptions: list) -> list:
+        unique, index = dedupe_texts(problem_descriptions)
         
-        base_prompt += """
-Please provide:
-
-1. MISSION STATEMENT: A clear, inspiring statement (2-3 sentences) that:
-   - Defines the core problem
-   - States the goal/objective
-   - Highlights the expected community impact
-
-2. PROBLEM DEFINITION: A precise definition of the issue (1-2 sentences)
-
-3. GOAL: The specific, measurable outcome we're working toward
-
-4. EXPECTED IMPACT: How this will benefit the community
-
-5. ACTION STEPS: 3-5 key steps to address this problem
-
-Format your response clearly with these headers."""
+        with ThreadPoolExecutor(max_workers=Config.THREAD_POOL_SIZE) as executor:
+            results = list(executor.map(self.generate_mission_statement, unique))
         
-        return base_prompt
+        return fan_out(results, index, problem_descriptions, 'original_description')
     
-    def _parse_mission_response(self, response: str) -> Dict:
-        parsed = {}
+    async def generate_batch_missions_async(self, problem_descriptions: List[str]) -> List[Dict]:
+        """Generate missions concurrently, at most Config.MAX_CONCURRENT at a time, in input order"""
+        semaphore = asyncio.Semaphore(Config.MAX_CONCURRENT)
         
-        sections = {
-            'mission_statement': ['MISSION STATEMENT:', 'Mission Statement:'],
-            'problem_definition': ['PROBLEM DEFINITION:', 'Problem Definition:'],
-            'goal': ['GOAL:', 'Goal:'],
-            'expected_impact': ['EXPECTED IMPACT:', 'Expected Impact:'],
-            'action_steps': ['ACTION STEPS:', 'Action Steps:']
-        }
+        async def generate_one(description: str) -> Dict:
+            async with semaphore:
+                return await self.generate_mission_statement_async(description)
         
-        for key, headers in sections.items():
-            for header in headers:
-                if header in response:
-                    # Extract text after this header and before the next section
-                    start_idx = response.find(header) + len(header)
-                    remaining = response[start_idx:]
-                    
-                    # Find the next header
-                    next_header_idx = len(remaining)
-                    for other_key, other_headers in sections.items():
-                        if other_key != key:
-                            for other_header in other_headers:
-                                idx = remaining.find(other_header)
-                                if idx != -1 and idx < next_header_idx:
-                                    next_header_idx = idx
-                    
-                    content = remaining[:next_header_idx].strip()
-                    
-                    # Special handling for action steps (convert to list)
-                    if key == 'action_steps':
-                        steps = [line.strip() for line in content.split('\n') 
-                                if line.strip() and (line.strip()[0].isdigit() or 
-                                line.strip().startswith('-') or line.strip().startswith('•'))]
-                        parsed[key] = steps
-                    else:
-                        parsed[key] = content
-                    break
-        
-        return parsed
-    
-    def generate_batch_missions(self, problem_descriptions: list) -> list:
-        results = []
-        for description in problem_descriptions:
-            result = self.generate_mission_statement(description)
-            results.append(result)
-        return results
+        unique, index = dedupe_texts(problem_descriptions)
+        results = await asyncio.gather(*(generate_one(d) for d in unique))
+        return fan_out(results, index, problem_descriptions, 'original_description')
 
 
 # Convenience function
@@ -0,0 +1,117 @@
+"""Parsers for plain-text Gemini replies.
+
+The clients ask for JSON and only fall back to these parsers when a reply is
+not structured. Nothing here imports the SDK or the app modules, and every
+function is fully annotated, so the module can be compiled with mypyc as a
+drop-in extension (see README).
+"""
+import re
+from typing import Dict, List, Optional, Pattern, Sequence, Tuple, Union
+
+
+# Section headers of a plain-text mission response, in upper or title case
+_MISSION_HEADER_RE = re.compile(
+    r'(MISSION STATEMENT|PROBLEM DEFINITION|GOAL|EXPECTED IMPACT|ACTION STEPS'
+    r'|Mission Statement|Problem Definition|Goal|Expected Impact|Action Steps):'
+)
+
+# A numbered ("1." / "1)") or bulleted ("-" / "•") line; group 1 is the step text
+_STEP_RE = re.compile(r'^\s*(?:\d+[.)]|[-•])\s*(.+?)\s*$')
+
+# Confidence keyword -> level; the earliest whole-word keyword in a reply wins
+_CONFIDENCE_LEVELS = {
+    keyword: level
+    for level, keywords in (
+        ('High', ('high', 'very confident', 'definitely', 'clearly')),
+        ('Medium', ('medium', 'moderate', 'fairly', 'somewhat')),
+        ('Low', ('low', 'uncertain', 'possibly', 'might'))
+    )
+    for keyword in keywords
+}
+
+_CONFIDENCE_RE = re.compile(r'\b(' + '|'.join(map(re.escape, _CONFIDENCE_LEVELS)) + r')\b')
+
+_REASONING_HEADER_RE = re.compile(r'REASONING:|Reasoning:')
+_BECAUSE_RE = re.compile(r'because|Because')
+
+
+class CategoryMatcher:
+    """Finds category names in a response with a single regex pass"""
+
+    def __init__(self, categories: Sequence[str]):
+        self.default = categories[0]
+        self.by_lower: Dict[str, str] = {cat.lower(): cat for cat in reversed(categories)}
+        # Longest names first so "Public Health" wins over "Health" at the same position
+        self.pattern: Pattern[str] = re.compile('|'.join(
+            re.escape(lower) for lower in sorted(self.by_lower, key=len, reverse=True)
+        ))
+
+    def match(self, response_lower: str) -> str:
+        """The earliest mention on a "category" line, else the earliest anywhere"""
+        matches = list(self.pattern.finditer(response_lower))
+        labelled = (m for m in matches if 'category' in _line_at(response_lower, m.start()))
+        found = next(labelled, matches[0] if matches else None)
+        return self.by_lower[found.group()] if found else self.default
+
+
+def _line_at(text: str, pos: int) -> str:
+    """Return the line of text containing position pos"""
+    end = text.find('\n', pos)
+    return text[text.rfind('\n', 0, pos) + 1:end if end != -1 else len(text)]
+
+
+def parse_classification(response: str, matcher: CategoryMatcher) -> Tuple[str, str, str]:
+    """(category, confidence, reasoning) from a free-form classification reply"""
+    response_lower = response.lower()
+
+    category = matcher.match(response_lower)
+
+    # Extract confidence: one scan for the earliest keyword
+    match = _CONFIDENCE_RE.search(response_lower)
+    confidence = _CONFIDENCE_LEVELS[match.group(1)] if match else "Unknown"
+
+    # Extract reasoning: from the REASONING header, else from the first "because"
+    match = _REASONING_HEADER_RE.search(response) or _BECAUSE_RE.search(response)
+    reasoning = response[match.start():].strip() if match else ""
+
+    if not reasoning:
+        reasoning = response
+
+    return category, confidence, reasoning
+
+
+def parse_mission_response(response: str) -> Dict[str, Union[str, List[str]]]:
+    """Mission fields from a reply laid out under MISSION STATEMENT:-style headers"""
+    parsed: Dict[str, Union[str, List[str]]] = {}
+
+    # One pass over the response finds every section header, in order
+    headers = [
+        (match.group(1).lower().replace(' ', '_'), match)
+        for match in _MISSION_HEADER_RE.finditer(response)
+    ]
+
+    # Each section starts at its first upper-case header, else its first
+    # title-case one, as the original per-header str.find scan did
+    starts: Dict[str, int] = {}
+    for i, (key, match) in enumerate(headers):
+        first = starts.get(key)
+        if first is None or (match.group(1).isupper()
+                             and not headers[first][1].group(1).isupper()):
+            starts[key] = i
+
+    for i in sorted(starts.values()):
+        key, match = headers[i]
+
+        # The section runs until the next header of a different section
+        end: Optional[int] = next(
+            (m.start() for other_key, m in headers[i + 1:] if other_key != key), None
+        )
+        content = response[match.end():end].strip()
+
+        # Special handling for action steps (convert to list, without the markers)
+        if key == 'action_steps':
+            parsed[key] = [m.group(1) for line in content.splitlines() if (m := _STEP_RE.match(line))]
+        else:
+            parsed[key] = content
+
+    return parsed
@@ -1,6 +1,116 @@
+import asyncio
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import Dict, Optional, List
 import google.generativeai as genai
+from cache import CachedGenerator, SemanticCache, dedupe_texts, disk_cache, fan_out
 from config import Config
+from gemini_client import get_model
+from parsers import CategoryMatcher, parse_classification
+
+
+# Prompts put the static instructions first and the problem text last, so
+# Gemini's prefix cache can reuse the instruction tokens across calls.
+_CLASSIFY_PREFIX_TMPL = """You are an expert classifier that categorizes community problems into three domains: 
+Environment, Health, and Education. You provide accurate classifications with clear reasoning.
+
+Classify the community problem at the end of this prompt into ONE of these categories:
+
+Categories and their scope:
+{categories_desc}
+
+Provide:
+
+- category: [Choose: Environment, Health, or Education]
+- confidence: [High, Medium, or Low]
+{reasoning_line}
+Choose only ONE primary category, even if the problem touches multiple areas.
+"""
+
+_REASONING_LINE = "- reasoning: [Explain why this category is most appropriate]\n"
+
+# Config.CATEGORIES and Config.DOMAIN_ISSUES are fixed at runtime, so the
+# category scope text and both prefix variants are built once at import
+_CATEGORIES_DESC = '\n'.join(
+    f"- {category}: Issues related to "
+    f"{', '.join(Config.DOMAIN_ISSUES.get(category, [])[:3])}, and similar concerns"
+    for category in Config.CATEGORIES
+)
+
+_CLASSIFY_PREFIXES = {
+    use_reasoning: sys.intern(_CLASSIFY_PREFIX_TMPL.format(
+        categories_desc=_CATEGORIES_DESC,
+        reasoning_line=_REASONING_LINE if use_reasoning else ""
+    ))
+    for use_reasoning in (True, False)
+}
+
+_VISION_CLASSIFY_STATIC_PREFIX = sys.intern("""You are an expert classifier that categorizes community problems into 
+three domains: Environment, Health, and Education. You provide accurate classifications with clear reasoning.
+
+Based on the vision analysis of a community problem image at the end of this prompt, classify the primary problem category.
+
+Classify the primary issue into one of these categories:
+- Environment
+- Health
+- Education
+
+Provide:
+- category: [Your classification]
+- confidence: [High/Medium/Low]
+- reasoning: [Why this category fits best]
+
+If multiple categories apply, choose the most dominant one.
+""")
+
+
+# Gemini returns JSON matching these schemas; parsers.parse_classification only
+# handles plain-text replies (e.g. from an endpoint without structured output)
+CONFIDENCE_LEVELS = ('High', 'Medium', 'Low')
+
+
+def _classification_schema(use_reasoning: bool) -> Dict:
+    properties = {
+        'category': {'type': 'STRING', 'format': 'enum', 'enum': list(Config.CATEGORIES)},
+        'confidence': {'type': 'STRING', 'format': 'enum', 'enum': list(CONFIDENCE_LEVELS)}
+    }
+    if use_reasoning:
+        properties['reasoning'] = {'type': 'STRING'}
+    
+    return {
+        'type': 'OBJECT',
+        'properties': properties,
+        'required': list(properties)
+    }
+
+
+# Also nested in integrated_system's single-shot schemas
+CLASSIFICATION_SCHEMA = _classification_schema(True)
+
+_CLASSIFICATION_CONFIGS = {
+    use_reasoning: genai.GenerationConfig(
+        response_mime_type='application/json',
+        response_schema=_classification_schema(use_reasoning)
+    )
+    for use_reasoning in (True, False)
+}
+
+
+def normalize_confidence(confidence) -> str:
+    """A confidence level from CONFIDENCE_LEVELS, or "Unknown" for an off-list value"""
+    confidence = str(confidence).strip().capitalize()
+    return confidence if confidence in CONFIDENCE_LEVELS else "Unknown"
+
+
+# Deterministic per (problem, use_reasoning), so repeat calls such as batch
+# re-runs reuse the built string instead of joining it again
+@lru_cache(maxsize=1024)
+def _build_classification_prompt(problem_description: str, use_reasoning: bool) -> str:
+    return ''.join([
+        _CLASSIFY_PREFIXES[use_reasoning], '\nProblem to classify:\n"', problem_description, '"\n'
+    ])
 
 
 class ProblemClassifier:
@@ -8,30 +118,45 @@ class ProblemClassifier:
     
     def __init__(self, api_key: Optional[str] = None):
         self.api_key = api_key or Config.GEMINI_API_KEY
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel(Config.TEXT_MODEL)
+        self.model = get_model(self.api_key, Config.TEXT_MODEL)
         self.categories = Config.CATEGORIES
+        self._categories_lower = [(cat, cat.lower()) for cat in self.categories]
+        self._category_matcher = CategoryMatcher(self.categories)
+        self.cache = disk_cache
+        self.semantic_cache = SemanticCache(threshold=Config.SEMANTIC_CACHE_THRESHOLD)
+        self.generator = CachedGenerator(
+            self.model, Config.TEXT_MODEL, self.cache, self.semantic_cache
+        )
     
     def classify_problem(self, problem_description: str, 
                         use_reasoning: bool = True) -> Dict:
         prompt = self._create_classification_prompt(problem_description, use_reasoning)
         
         try:
-            response = self.model.generate_content(prompt)
-            result = response.text
-            
-            # Parse the classification
-            category, confidence, reasoning = self._parse_classification(result)
+            decoded, result = self.generator.generate(
+                prompt, self._decode_classification, _CLASSIFICATION_CONFIGS[use_reasoning],
+                problem_description, ('classify', use_reasoning)
+            )
+            return self._classification_result(problem_description, decoded, result)
             
+        except Exception as e:
             return {
-                'success': True,
-                'problem_description': problem_description,
-                'category': category,
-                'confidence': confidence,
-                'reasoning': reasoning,
-                'all_categories': self.categories,
-                'full_response': result
+                'success': False,
+                'error': str(e),
+                'problem_description': problem_description
             }
+    
+    async def classify_problem_async(self, problem_description: str,
+                                     use_reasoning: bool = True) -> Dict:
+        """Async variant of classify_problem"""
+        prompt = self._create_classification_prompt(problem_description, use_reasoning)
+        
+        try:
+            decoded, result = await self.generator.generate_async(
+                prompt, self._decode_classification, _CLASSIFICATION_CONFIGS[use_reasoning],
+                problem_description, ('classify', use_reasoning)
+            )
+            return self._classification_result(problem_description, decoded, result)
             
         except Exception as e:
             return {
@@ -40,31 +165,27 @@ class ProblemClassifier:
                 'problem_description': problem_description
             }
     
+    def _classification_result(self, problem_description: str, decoded: tuple,
+                               result: str) -> Dict:
+        category, confidence, reasoning = decoded
+        
+        return {
+            'success': True,
+            'problem_description': problem_description,
+            'category': category,
+            'confidence': confidence,
+            'reasoning': reasoning,
+            'all_categories': self.categories,
+            'full_response': result
+        }
+    
     def classify_with_vision_analysis(self, vision_analysis: str) -> Dict:
-        prompt = f"""You are an expert classifier that categorizes community problems into 
-three domains: Environment, Health, and Education. You provide accurate classifications with clear reasoning.
-
-Based on the following vision analysis of a community problem image, classify the primary problem category:
-
-Vision Analysis:
-{vision_analysis}
-
-Classify the primary issue into one of these categories:
-- Environment
-- Health
-- Education
-
-Provide:
-1. PRIMARY CATEGORY: [Your classification]
-2. CONFIDENCE: [High/Medium/Low]
-3. REASONING: [Why this category fits best]
-
-If multiple categories apply, choose the most dominant one."""
+        prompt = ''.join([_VISION_CLASSIFY_STATIC_PREFIX, '\nVision Analysis:\n', vision_analysis, '\n'])
         
         try:
-            response = self.model.generate_content(prompt)
-            result = response.text
-            category, confidence, reasoning = self._parse_classification(result)
+            (category, confidence, reasoning), _ = self.generator.generate(
+                prompt, self._decode_classification, _CLASSIFICATION_CONFIGS[True]
+            )
             
             return {
                 'success': True,
@@ -82,102 +203,51 @@ If multiple categories apply, choose the most dominant one."""
     
     def _create_classification_prompt(self, problem_description: str, 
                                      use_reasoning: bool) -> str:
-        categories_desc = self._get_category_descriptions()
-        
-        prompt = f"""You are an expert classifier that categorizes community problems into three domains: 
-Environment, Health, and Education. You provide accurate classifications with clear reasoning.
-
-Classify the following community problem into ONE of these categories:
-
-Categories and their scope:
-{categories_desc}
-
-Problem to classify:
-"{problem_description}"
-
-Provide your response in this format:
-
-PRIMARY CATEGORY: [Choose: Environment, Health, or Education]
-CONFIDENCE: [High, Medium, or Low]
-"""
-        
-        if use_reasoning:
-            prompt += "REASONING: [Explain why this category is most appropriate]\n"
-        
-        prompt += "\nChoose only ONE primary category, even if the problem touches multiple areas."
-        
-        return prompt
+        return _build_classification_prompt(problem_description, use_reasoning)
     
-    def _get_category_descriptions(self) -> str:
-        descriptions = []
+    def _decode_classification(self, response: str) -> tuple:
+        """(category, confidence, reasoning) from a JSON reply, else via the text parser.
         
-        for category in self.categories:
-            issues = Config.DOMAIN_ISSUES.get(category, [])
-            examples = ', '.join(issues[:3])
-            descriptions.append(
-                f"- {category}: Issues related to {examples}, and similar concerns"
-            )
+        Raises ValueError for a reply that names no category, such as JSON cut
+        off mid-string, rather than falling back to the default category.
+        """
+        try:
+            data = json.loads(response)
+        except ValueError:
+            if response.lstrip().startswith('{') or \
+                    not self._category_matcher.pattern.search(response.lower()):
+                raise ValueError("Classification reply names no category")
+            return parse_classification(response, self._category_matcher)
+        if not isinstance(data, dict) or 'category' not in data:
+            raise ValueError("Classification reply is missing the category")
         
-        return '\n'.join(descriptions)
+        # The schema enforces the enums, but an off-list value still degrades gracefully
+        category_lower = str(data['category']).lower()
+        category = next(
+            (cat for cat, cat_lower in self._categories_lower if cat_lower in category_lower),
+            self.categories[0]
+        )
+        return category, normalize_confidence(data.get('confidence', '')), data.get('reasoning', '')
     
-    def _parse_classification(self, response: str) -> tuple:
-        category = None
-        confidence = "Unknown"
-        reasoning = ""
-        
-        # Extract category
-        for cat in self.categories:
-            if cat.lower() in response.lower():
-                category = cat
-                break
-        
-        # If no exact match, try to extract from structured response
-        if not category:
-            if "PRIMARY CATEGORY:" in response or "Category:" in response:
-                lines = response.split('\n')
-                for line in lines:
-                    if "CATEGORY:" in line.upper():
-                        for cat in self.categories:
-                            if cat.lower() in line.lower():
-                                category = cat
-                                break
-        
-        # Default to first match in text if still not found
-        if not category:
-            category = self.categories[0]  # Default fallback
-        
-        # Extract confidence
-        confidence_keywords = {
-            'high': ['high', 'very confident', 'definitely', 'clearly'],
-            'medium': ['medium', 'moderate', 'fairly', 'somewhat'],
-            'low': ['low', 'uncertain', 'possibly', 'might']
-        }
+    def classify_batch(self, problem_descriptions: List[str]) -> List[Dict]:
+        unique, index = dedupe_texts(problem_descriptions)
         
-        response_lower = response.lower()
-        for level, keywords in confidence_keywords.items():
-            if any(keyword in response_lower for keyword in keywords):
-                confidence = level.capitalize()
-                break
+        with ThreadPoolExecutor(max_workers=Config.THREAD_POOL_SIZE) as executor:
+            results = list(executor.map(self.classify_problem, unique))
         
-        # Extract reasoning
-        reasoning_markers = ['REASONING:', 'Reasoning:', 'because', 'Because']
-        for marker in reasoning_markers:
-            if marker in response:
-                start_idx = response.find(marker)
-                reasoning = response[start_idx:].strip()
-                break
+        return fan_out(results, index, problem_descriptions, 'problem_description')
+    
+    async def classify_batch_async(self, problem_descriptions: List[str]) -> List[Dict]:
+        """Classify concurrently, at most Config.MAX_CONCURRENT at a time, in input order"""
+        semaphore = asyncio.Semaphore(Config.MAX_CONCURRENT)
         
-        if not reasoning:
-            reasoning = response
+        async def classify_one(description: str) -> Dict:
+            async with semaphore:
+                return await self.classify_problem_async(description)
         
-        return category, confidence, reasoning
-    
-    def classify_batch(self, problem_descriptions: List[str]) -> List[Dict]:
-        results = []
-        for description in problem_descriptions:
-            result = self.classify_problem(description)
-            results.append(result)
-        return results
+        unique, index = dedupe_texts(problem_descriptions)
+        results = await asyncio.gather(*(classify_one(d) for d in unique))
+        return fan_out(results, index, problem_descriptions, 'problem_description')
 
 
 # Convenience function
@@ -0,0 +1,49 @@
+import asyncio
+import threading
+import time
+
+from config import Config
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` calls per `period` seconds.
+
+    Shared by sync and async callers; a rate of 0 disables limiting.
+    """
+
+    def __init__(self, rate: int, period: float = 60.0):
+        self.rate = rate
+        self.period = period
+        self._tokens = float(rate)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Take a token and return how long the caller must wait before using it"""
+        if self.rate <= 0:
+            return 0.0
+
+        with self._lock:
+            now = time.monotonic()
+            refill = (now - self._updated) * self.rate / self.period
+            self._tokens = min(float(self.rate), self._tokens + refill)
+            self._updated = now
+
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens * self.period / self.rate
+
+    def acquire(self):
+        delay = self._reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        delay = self._reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+# Gemini quotas are per project, so all clients in the process share one bucket
+gemini_rate_limiter = RateLimiter(Config.GEMINI_RPM)
@@ -1,8 +1,122 @@
+import asyncio
 import base64
+import hashlib
+import io
+import mimetypes
 import os
-from typing import Dict, List, Optional
-import google.generativeai as genai
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from cache import disk_cache, make_cache_key
 from config import Config
+from gemini_client import generate, generate_async, get_model
+
+
+# Leading magic bytes of the upload formats in Config.ALLOWED_EXTENSIONS
+_IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+# Finish reasons of a reply that holds a usable analysis; SAFETY, RECITATION
+# and the like end the reply early, usually with no text at all
+_COMPLETE_FINISH_REASONS = frozenset({'STOP', 'MAX_TOKENS'})
+
+
+def sniff_mime_type(image_bytes: bytes) -> Optional[str]:
+    """Identify an encoded image from its first 12 bytes, without decoding it"""
+    header = image_bytes[:12]
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp'
+    for signature, mime_type in _IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return mime_type
+    return None
+
+
+def guess_mime_type(image_bytes: bytes, image_path: Optional[str] = None) -> str:
+    """MIME type from the magic number, then the file extension, defaulting to JPEG"""
+    return (sniff_mime_type(image_bytes)
+            or (image_path and mimetypes.guess_type(image_path)[0])
+            or 'image/jpeg')
+
+
+def downscale_image(image_bytes: bytes, mime_type: str) -> Tuple[bytes, str]:
+    """Shrink an encoded image to the vision model's input size, re-encoded as WebP.
+    
+    Small files and images that already fit are returned unchanged, so
+    they are never decoded or re-encoded.
+    """
+    if len(image_bytes) < Config.VISION_DOWNSCALE_MIN_BYTES:
+        return image_bytes, mime_type
+    
+    from PIL import Image, ImageOps
+    Image.MAX_IMAGE_PIXELS = Config.MAX_IMAGE_PIXELS
+    
+    # Opening is lazy: only the header is read until the pixels are needed
+    img = Image.open(io.BytesIO(image_bytes))
+    limit = Config.VISION_MAX_DIMENSION
+    if max(img.size) <= limit:
+        return image_bytes, mime_type
+    
+    # The WebP re-encode drops EXIF, so apply the orientation tag (phone photos) first
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail((limit, limit), Image.LANCZOS)
+    if img.mode not in ('RGB', 'RGBA'):
+        has_alpha = 'A' in img.getbands() or 'transparency' in img.info
+        img = img.convert('RGBA' if has_alpha else 'RGB')
+    
+    buf = io.BytesIO()
+    img.save(buf, format='WEBP', quality=Config.VISION_WEBP_QUALITY, method=4)
+    return buf.getvalue(), 'image/webp'
+
+
+# The detection prompt depends only on the domains, so it is byte-identical for
+# a given domain set; the image is sent after it as the only varying part.
+_DETECTION_PREFIX_TMPL = """You are an AI assistant specialized in identifying community issues in images.
+
+Analyze this image and identify any visible community problems in the following domains:
+{domains}
+
+For each domain, look for issues such as:
+{examples_text}
+"""
+
+_DETECTION_STATIC_TAIL = sys.intern("""
+Please provide:
+1. A list of all visible issues identified in the image
+2. The domain category for each issue (Environment, Health, or Education)
+3. A brief description of each problem
+4. The severity level (Low, Medium, High)
+5. Specific visual evidence you observed
+
+Format your response as:
+
+DETECTED ISSUES:
+[List each issue with its domain, description, and severity]
+
+VISUAL EVIDENCE:
+[Describe what you see that indicates these problems]
+
+RECOMMENDATIONS:
+[Brief suggestions for addressing the issues]
+
+Be specific and objective in your analysis.""")
+
+
+def _checked_analysis(text: str, response) -> str:
+    """Return text if it is a usable analysis, else raise ValueError.
+    
+    An empty reply, or one cut short for e.g. safety, must not be cached or
+    passed on to classification as a successful detection.
+    """
+    candidates = response.candidates
+    finish_reason = candidates[0].finish_reason.name if candidates else None
+    if not text.strip() or finish_reason not in _COMPLETE_FINISH_REASONS:
+        raise ValueError(f"Vision analysis incomplete (finish reason: {finish_reason})")
+    return text
 
 
 class CommunityIssueDetector:
@@ -10,36 +124,148 @@ class CommunityIssueDetector:
     
     def __init__(self, api_key: Optional[str] = None):
         self.api_key = api_key or Config.GEMINI_API_KEY
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel(Config.VISION_MODEL)
+        self.model = get_model(self.api_key, Config.VISION_MODEL)
+        self.cache = disk_cache
         
     def encode_image(self, image_path: str) -> str:
         with open(image_path, "rb") as image_file:
             return base64.b64encode(image_file.read()).decode('utf-8')
     
     def detect_issues(self, image_path: str, domains: Optional[List[str]] = None) -> Dict:
+        try:
+            # Read the encoded image once; it is sent to Gemini without a PIL round-trip
+            with open(image_path, 'rb') as f:
+                image_bytes = f.read()
+        except OSError as e:
+            return {
+                'success': False,
+                'error': str(e),
+                'domains_analyzed': domains or Config.CATEGORIES
+            }
+        
+        return self.detect_issues_from_bytes(
+            image_bytes, guess_mime_type(image_bytes, image_path), domains
+        )
+    
+    async def detect_issues_async(self, image_path: str,
+                                  domains: Optional[List[str]] = None) -> Dict:
+        """Async variant of detect_issues"""
+        try:
+            image_bytes = await asyncio.to_thread(self._read_file, image_path)
+        except OSError as e:
+            return {
+                'success': False,
+                'error': str(e),
+                'domains_analyzed': domains or Config.CATEGORIES
+            }
+        
+        return await self._detect_async(
+            image_bytes, guess_mime_type(image_bytes, image_path), domains
+        )
+    
+    @staticmethod
+    def _read_file(image_path: str) -> bytes:
+        with open(image_path, 'rb') as f:
+            return f.read()
+    
+    def detect_issues_from_bytes(self, image_bytes: bytes, mime_type: str,
+                                 domains: Optional[List[str]] = None,
+                                 on_text: Optional[Callable[[str], Any]] = None) -> Dict:
+        """Detect issues in an already-encoded image without writing it to disk.
+        
+        With on_text, the response is streamed and on_text receives the
+        analysis received so far after each chunk.
+        """
+        return self._detect(image_bytes, mime_type, domains, on_text)
+    
+    def generate_from_bytes(self, image_bytes: bytes, mime_type: str, prompt_suffix: str,
+                            generation_config=None,
+                            domains: Optional[List[str]] = None) -> str:
+        """Run the detection prompt plus extra instructions on an image; returns the response text.
+        
+        Unlike detect_issues, errors are raised to the caller.
+        """
+        domains = domains or Config.CATEGORIES
+        image_bytes, mime_type = downscale_image(image_bytes, mime_type)
+        prompt = self._create_detection_prompt(domains) + prompt_suffix
+        
+        response = generate(
+            self.model,
+            [prompt, {'mime_type': mime_type, 'data': image_bytes}],
+            generation_config=generation_config
+        )
+        return response.text
+    
+    def _detect(self, image_bytes: bytes, mime_type: str, domains: Optional[List[str]],
+                on_text: Optional[Callable[[str], Any]] = None) -> Dict:
         domains = domains or Config.CATEGORIES
         
         # Create the prompt
         prompt = self._create_detection_prompt(domains)
+        cache_key = self._detection_cache_key(prompt, image_bytes)
         
         try:
-            # Read and prepare the image
-            from PIL import Image
-            img = Image.open(image_path)
+            # An empty cached analysis can only be a stale unusable reply
+            analysis = self.cache.get(cache_key)
+            if analysis:
+                return self._detection_result(analysis, domains)
             
-            # Call Gemini Vision API
-            response = self.model.generate_content([prompt, img])
+            # Only a cache miss pays for decoding and downscaling the image
+            image_bytes, mime_type = downscale_image(image_bytes, mime_type)
+            image_part = {'mime_type': mime_type, 'data': image_bytes}
             
-            # Parse the response
-            analysis = response.text
+            # Call Gemini Vision API
+            if on_text is None:
+                response = generate(self.model, [prompt, image_part])
+                analysis = _checked_analysis(response.text, response)
+            else:
+                response, analysis = self._stream([prompt, image_part], on_text)
+            self.cache.set(cache_key, analysis)
+            return self._detection_result(analysis, domains, response)
             
+        except Exception as e:
             return {
-                'success': True,
-                'analysis': analysis,
-                'raw_response': response,
+                'success': False,
+                'error': str(e),
                 'domains_analyzed': domains
             }
+    
+    def _stream(self, contents, on_text: Callable[[str], Any]) -> Tuple[Any, str]:
+        """Generate with stream=True, reporting the accumulated text after each chunk.
+        
+        Raises ValueError if the stream ends without a usable analysis.
+        """
+        response = generate(self.model, contents, stream=True)
+        text = ''
+        for chunk in response:
+            try:
+                text += chunk.text
+            except ValueError:
+                # A chunk without text parts, e.g. only a finish reason
+                continue
+            on_text(text)
+        return response, _checked_analysis(text, response)
+    
+    async def _detect_async(self, image_bytes: bytes, mime_type: str,
+                            domains: Optional[List[str]]) -> Dict:
+        domains = domains or Config.CATEGORIES
+        prompt = self._create_detection_prompt(domains)
+        cache_key = self._detection_cache_key(prompt, image_bytes)
+        
+        try:
+            analysis = self.cache.get(cache_key)
+            if analysis:
+                return self._detection_result(analysis, domains)
+            
+            # The decode/resize/encode runs in a worker thread, so concurrent
+            # detections do not queue their CPU work on the loop
+            image_bytes, mime_type = await asyncio.to_thread(downscale_image, image_bytes, mime_type)
+            response = await generate_async(
+                self.model, [prompt, {'mime_type': mime_type, 'data': image_bytes}]
+            )
+            analysis = _checked_analysis(response.text, response)
+            self.cache.set(cache_key, analysis)
+            return self._detection_result(analysis, domains, response)
             
         except Exception as e:
             return {
@@ -48,6 +274,34 @@ class CommunityIssueDetector:
                 'domains_analyzed': domains
             }
     
+    @staticmethod
+    def _detection_cache_key(prompt: str, image_bytes: bytes) -> str:
+        """Keyed on the image as uploaded, so a hit never decodes or downscales it"""
+        return make_cache_key(
+            model=Config.VISION_MODEL, prompt=prompt, image=hashlib.sha256(image_bytes).hexdigest()
+        )
+    
+    def _detection_result(self, analysis: str, domains: List[str], response=None) -> Dict:
+        """Shape a detection result; response is None when served from the disk cache.
+        
+        Only plain values are copied out of the SDK response, so results do not
+        keep it alive: 'usage' holds token counts and 'finish_reason' the
+        reason name, both None on a cache hit.
+        """
+        usage = getattr(response, 'usage_metadata', None)
+        candidates = getattr(response, 'candidates', None)
+        return {
+            'success': True,
+            'analysis': analysis,
+            'usage': {
+                'prompt_token_count': usage.prompt_token_count,
+                'candidates_token_count': usage.candidates_token_count,
+                'total_token_count': usage.total_token_count
+            } if usage else None,
+            'finish_reason': candidates[0].finish_reason.name if candidates else None,
+            'domains_analyzed': domains
+        }
+    
     def _create_detection_prompt(self, domains: List[str]) -> str:
         domain_examples = []
         for domain in domains:
@@ -57,44 +311,33 @@ class CommunityIssueDetector:
         
         examples_text = '\n'.join(domain_examples)
         
-        prompt = f"""You are an AI assistant specialized in identifying community issues in images.
-
-Analyze this image and identify any visible community problems in the following domains:
-{', '.join(domains)}
-
-For each domain, look for issues such as:
-{examples_text}
-
-Please provide:
-1. A list of all visible issues identified in the image
-2. The domain category for each issue (Environment, Health, or Education)
-3. A brief description of each problem
-4. The severity level (Low, Medium, High)
-5. Specific visual evidence you observed
-
-Format your response as:
-
-DETECTED ISSUES:
-[List each issue with its domain, description, and severity]
-
-VISUAL EVIDENCE:
-[Describe what you see that indicates these problems]
-
-RECOMMENDATIONS:
-[Brief suggestions for addressing the issues]
-
-Be specific and objective in your analysis."""
-        
-        return prompt
+        return _DETECTION_PREFIX_TMPL.format(
+            domains=', '.join(domains),
+            examples_text=examples_text
+        ) + _DETECTION_STATIC_TAIL
     
     def detect_multiple_images(self, image_paths: List[str], 
                               domains: Optional[List[str]] = None) -> List[Dict]:
-        results = []
-        for image_path in image_paths:
+        def detect_one(image_path: str) -> Dict:
             result = self.detect_issues(image_path, domains)
             result['image_path'] = image_path
-            results.append(result)
-        return results
+            return result
+        
+        with ThreadPoolExecutor(max_workers=Config.THREAD_POOL_SIZE) as executor:
+            return list(executor.map(detect_one, image_paths))
+    
+    async def detect_multiple_images_async(self, image_paths: List[str],
+                                           domains: Optional[List[str]] = None) -> List[Dict]:
+        """Detect issues in all images concurrently, at most Config.MAX_CONCURRENT at a time"""
+        semaphore = asyncio.Semaphore(Config.MAX_CONCURRENT)
+        
+        async def detect_one(image_path: str) -> Dict:
+            async with semaphore:
+                result = await self.detect_issues_async(image_path, domains)
+            result['image_path'] = image_path
+            return result
+        
+        return await asyncio.gather(*(detect_one(path) for path in image_paths))
 
 
 # Convenience function